@@ -1,26 +1,160 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, request, send_file, jsonify
-import pandas as pd
-import logging
+from flask import Flask, Request, Response, render_template, request, send_file, jsonify, url_for
+import io
+import os
+import socket
+import struct
+import threading
+import time
 import uuid
-from werkzeug.datastructures import ImmutableMultiDict
+import zlib
+
+from ingest import spool_file, spool_upload, stream_size
+from jobs import DONE, JOB_THRESHOLD_BYTES, JOB_WORKERS, RUNNING, JobRunner, JobStore
+from log_config import get_logger
+from metrics import CONTENT_TYPE, render_metrics
+
+WARMUP = os.environ.get('WARMUP', '1') == '1'
+# Сжатие результата gzip, если клиент его принимает (Accept-Encoding).
+DOWNLOAD_GZIP = os.environ.get('DOWNLOAD_GZIP', '1') == '1'
+DOWNLOAD_GZIP_LEVEL = int(os.environ.get('DOWNLOAD_GZIP_LEVEL', 6))
 
-from app_func import load_models, load_rank_data, make_prediction, save_results
-from csv_func import collect_form_data, prepare_data, calculate_student_ranks
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spool_file()
 
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+
+logger = get_logger(__name__)
+
+# pandas, модели и данные рангов нужны только для предсказаний: страницы
+# и статика отдаются сразу, а загрузка идёт в фоне или при первом запросе.
+startup = {'state': 'cold', 'error': None, 'started_at': time.time(), 'timings': {}}
+startup_lock = threading.Lock()
+
+
+def load_prediction():
+    with startup_lock:
+        if startup['state'] == 'ready':
+            return startup['module']
+
+        startup['state'] = 'loading'
+        try:
+            started = time.perf_counter()
+            import prediction
+            imported = time.perf_counter()
+            prediction.get_artifacts()
+            loaded = time.perf_counter()
+        except Exception as e:
+            startup['state'] = 'error'
+            startup['error'] = str(e)
+            logger.critical(f"Ошибка инициализации: {e}")
+            raise
+
+        startup['timings'] = {
+            'import_s': round(imported - started, 3),
+            'artifacts_s': round(loaded - imported, 3),
+            'ready_after_start_s': round(time.time() - startup['started_at'], 3),
+        }
+        startup.update(state='ready', error=None, module=prediction)
+        logger.info(f"Модели готовы: {startup['timings']}")
+        return prediction
+
+
+def warm_up():
+    try:
+        load_prediction()
+    except Exception:
+        pass
+
+
+def start_warm_up():
+    if startup['state'] == 'cold':
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+if WARMUP:
+    start_warm_up()
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
 
-try:
-    (model_bak, threshold_bak, features_bak_spec,
-     model_mag, threshold_mag, features_mag) = load_models()
-    stats_mag, penalties_mag, stats_bak, penalties_bak = load_rank_data()
-except Exception as e:
-    logger.critical(f"Ошибка инициализации: {e}")
-    exit(1)
+def process_job_file(path, output, education_level, progress):
+    return load_prediction().predict_file(path, output, education_level, progress)
+
+
+job_store = JobStore()
+job_runner = JobRunner(job_store, process_job_file)
+
+
+def submit_job(upload, education_level: str, filename: str) -> dict:
+    meta = job_store.create(upload, education_level, filename)
+    job_runner.submit(meta['id'])
+    logger.info("Файл %s поставлен в очередь, задание %s", filename, meta['id'])
+    return meta
+
+
+def job_view(meta: dict) -> dict:
+    view = dict(meta)
+    view.pop('pid', None)
+    view['status_url'] = url_for('job_status', job_id=meta['id'])
+    if meta['status'] == DONE:
+        view['download_url'] = url_for('job_download', job_id=meta['id'])
+    if meta['finished_at']:
+        view['expires_at'] = meta['updated_at'] + job_store.ttl
+    return view
+
+
+def gzip_chunks(chunks, level: int = DOWNLOAD_GZIP_LEVEL):
+    # Каждая часть сбрасывается сразу (Z_SYNC_FLUSH): клиент получает данные
+    # по мере обработки, а не после сжатия всего файла.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def abort_connection(environ):
+    # gunicorn и сервер разработки werkzeug передают сокет клиента в environ.
+    # Сами они после ошибки закрывают соединение штатно (FIN), и без chunked
+    # (HTTP/1.0, буферизующий прокси) обрыв выглядит как конец файла. Закрытие
+    # с SO_LINGER=0 отправляет RST — клиент получает ошибку соединения.
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        sock.close()
+    except OSError:
+        pass
+
+
+def logged_chunks(chunks, upload=None, environ=None):
+    # Заголовки уже отправлены: ошибку в середине файла можно только записать
+    # в лог и оборвать соединение. Иначе клиент получит статус 200 и
+    # укороченный, но правильный с виду CSV.
+    try:
+        yield from chunks
+    except Exception as e:
+        logger.error(f"Ошибка при отправке результата: {e}", exc_info=True)
+        if environ is not None:
+            abort_connection(environ)
+        raise
+    finally:
+        if upload is not None:
+            upload.close()
+
+
+def download_response(chunks, filename: str, upload=None) -> Response:
+    headers = {'Content-Disposition': f'attachment; filename={filename}', 'Vary': 'Accept-Encoding'}
+    chunks = logged_chunks(chunks, upload, request.environ)
+    if DOWNLOAD_GZIP and request.accept_encodings['gzip']:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, mimetype='text/csv', headers=headers)
 
 
 @app.route('/')
@@ -38,8 +172,26 @@ def team():
     return render_template('team.html')
 
 
-import io
-from werkzeug.datastructures import FileStorage
+@app.route('/ready')
+def ready():
+    # Проба готовности: 200 после загрузки моделей, иначе 503. Обращение к
+    # холодному процессу запускает загрузку в фоне.
+    start_warm_up()
+    body = {
+        'state': startup['state'],
+        'error': startup['error'],
+        'uptime_s': round(time.time() - startup['started_at'], 3),
+        'timings': startup['timings'],
+    }
+    if startup['state'] == 'ready':
+        body['artifacts_version'] = startup['module'].get_artifacts().version
+        return jsonify(body), 200
+    return jsonify(body), 503
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
 
 
 @app.route('/predict', methods=['GET', 'POST'])
@@ -50,61 +202,34 @@ def predict():
             if not education_level:
                 return render_template('prediction.html',
                                        show_results=False,
-                                       error="Не указан уровень образования")
+                                       error="Не указан уровень образования"), 400
+            if education_level not in ('magistr', 'bak_spec'):
+                return render_template('prediction.html',
+                                       show_results=False,
+                                       error=f"Неизвестный уровень образования: {education_level}"), 400
 
-            logger.info(f"Обработка для уровня образования: {education_level}")
+            logger.info("Обработка для уровня образования: %s", education_level)
 
-            if education_level == 'bak_spec':
-                model, threshold, features = model_bak, threshold_bak, features_bak_spec
-            else:
-                model, threshold, features = model_mag, threshold_mag, features_mag
+            prediction = load_prediction()
+            artifacts = prediction.get_artifacts()
 
             if 'file' in request.files:
                 file = request.files['file']
                 if file.filename != '':
                     try:
-                        encodings = ['utf-8', 'cp1251', 'latin1', 'iso-8859-1']
-                        df = None
-                        for encoding in encodings:
-                            try:
-                                file.seek(0)
-                                df = pd.read_csv(io.StringIO(file.read().decode(encoding)), sep=';')
-                                break
-                            except UnicodeDecodeError:
-                                continue
-
-                        if df is None:
-                            raise ValueError("Не удалось прочитать файл. Проверьте кодировку")
-
-                        logger.error(f"Ошибка при обработке файла: {df}")
-
-                        if education_level == 'magistr':
-                            df['Уровень подготовки'] = 'Магистр'
-                        else:
-                            df['Уровень подготовки'] = 'Бакалавр'
-
-                        df = process_student_csv(df, education_level, features_mag, features_bak_spec)
-                        df_prepared = prepare_data(df, education_level, features_mag, features_bak_spec)
-
-                        logger.info(f"DATASET: {df_prepared}")
-
-                        result = make_prediction_csv(df_prepared, model, threshold, features)
-
-                        logger.error(f"RESULT!!!!!!!!!!!!!!!!!!!!!!!!!!!!!: {result}")
-
-                        output = io.StringIO()
-                        result.to_csv(output, index=False, sep=';')
-
-                        mem = io.BytesIO()
-                        mem.write(output.getvalue().encode('utf-8'))
-                        mem.seek(0)
-
-                        return send_file(
-                            mem,
-                            mimetype='text/csv',
-                            as_attachment=True,
-                            download_name='predictions.csv'
-                        )
+                        upload = spool_upload(file.stream)
+                        size = stream_size(upload)
+                        if JOB_WORKERS > 0 and size >= JOB_THRESHOLD_BYTES:
+                            job = submit_job(upload, education_level, file.filename)
+                            return render_template('prediction.html',
+                                                   active_tab=education_level,
+                                                   show_results=False,
+                                                   job=job_view(job))
+                        chunks = prediction.stream_predictions(upload, education_level, artifacts)
+                        # Остаток файла читается уже после выхода из обработчика, а Flask
+                        # закрывает файлы запроса: загрузку закрывает сам ответ.
+                        file.stream = io.BytesIO()
+                        return download_response(chunks, 'predictions.csv', upload)
 
                     except Exception as e:
                         logger.error(f"Ошибка при обработке файла: {e}")
@@ -112,11 +237,7 @@ def predict():
                                                show_results=False,
                                                error=f"Ошибка обработки файла: {str(e)}")
 
-            form_data = collect_form_data(request.form, education_level, features_mag, features_bak_spec)
-            df = pd.DataFrame([form_data])
-            df_prepared = prepare_data(df, education_level, features_mag, features_bak_spec)
-
-            result = make_prediction(df_prepared, model, threshold, features)
+            result = prediction.predict_form(request.form, education_level, artifacts)
 
             return render_template('prediction.html',
                       active_tab=education_level, 
@@ -132,78 +253,24 @@ def predict():
     return render_template('prediction.html', show_results=False, error=None)
 
 
-def process_student_csv(df: pd.DataFrame, education_level: str, features_mag, features_bak_spec):
-    try:
-        column_mapping = {
-            'Наименование дисциплины': 'subject_name',
-            'Оценка': 'subject_grade',
-            'Баллы': 'subject_score',
-            'Количество пересдач': 'subject_retakes'
-        }
-        df = df.rename(columns=column_mapping)
-
-        student_groups = df.groupby('id_студента')
-        processed_data = []
-
-        for student_id, group in student_groups:
-            student_data = group.iloc[0].to_dict()
+@app.route('/what_if', methods=['POST'])
+def what_if():
+    # {"education_level": ..., "profile": {поля формы, "subjects": [...]}, "grid": {ось: [значения]}}
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Ожидается JSON-объект'}), 400
+    education_level = payload.get('education_level')
+    if education_level not in ('magistr', 'bak_spec'):
+        return jsonify({'error': 'Не указан уровень образования'}), 400
 
-            prefix = 'm_' if education_level == 'magistr' else 'b_'
-            subjects = {
-                f"{prefix}subject_name[]": [],
-                f"{prefix}subject_grade[]": [],
-                f"{prefix}subject_score[]": [],
-                f"{prefix}subject_retakes[]": []
-            }
-
-            for _, row in group.iterrows():
-                subjects[f"{prefix}subject_name[]"].append(str(row.get("subject_name", "")))
-                subjects[f"{prefix}subject_grade[]"].append(str(row.get("subject_grade", "")))
-                subjects[f"{prefix}subject_score[]"].append(str(row.get("subject_score", "")))
-                subjects[f"{prefix}subject_retakes[]"].append(str(row.get("subject_retakes", 0)))
-
-            full_data = {**student_data, **subjects}
-
-            multidict_data = []
-            for key, value in full_data.items():
-                if isinstance(value, list):
-                    for item in value:
-                        multidict_data.append((key, item))
-                else:
-                    multidict_data.append((key, value))
-
-            form_input = ImmutableMultiDict(multidict_data)
-
-            form_data = collect_form_data(form_input, education_level, features_mag, features_bak_spec)
-            processed_data.append({
-                'id_студента': student_id,
-                **form_data
-            })
-
-        return pd.DataFrame(processed_data)
-
-    except Exception as e:
-        logger.error(f"Ошибка обработки CSV: {e}", exc_info=True)
-        raise
-
-
-def make_prediction_csv(df: pd.DataFrame, model, threshold: float, features: list):
-    missing = set(features) - set(df.columns)
-    if missing:
-        raise ValueError(f"Отсутствуют обязательные фичи: {missing}")
-
-    if hasattr(model, 'predict_proba'):
-        proba = model.predict_proba(df[features])[:, 1]
-    else:
-        proba = model.predict(df[features])
-
-    result_df = pd.DataFrame({
-        'id': df.index if 'id' not in df.columns else df['id'],
-        'probability': (proba * 100).round(2),
-        'above_threshold': proba >= threshold
-    })
+    prediction = load_prediction()
+    try:
+        result = prediction.predict_what_if(payload.get('profile') or {}, payload.get('grid'),
+                                            education_level, prediction.get_artifacts())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
 
-    return result_df
 
 from flask import send_from_directory
 
@@ -227,16 +294,62 @@ def download_example(education_level):
         logger.error(f"Ошибка при скачивании примера CSV: {e}")
         return jsonify({'error': str(e)}), 500
     
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    education_level = request.form.get('education_level')
+    if education_level not in ('magistr', 'bak_spec'):
+        return jsonify({'error': 'Не указан уровень образования'}), 400
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'Не передан файл'}), 400
+
+    job = submit_job(spool_upload(file.stream), education_level, file.filename)
+    view = job_view(job)
+    return jsonify(view), 202, {'Location': view['status_url']}
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    # Опрос статуса запускает и очистку: задания, брошенные при перезапуске,
+    # подхватываются без новых загрузок.
+    job_runner.start()
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задание не найдено или срок хранения истёк'}), 404
+    return jsonify(job_view(job))
+
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задание не найдено или срок хранения истёк'}), 404
+    if job['status'] != DONE:
+        return jsonify({'error': 'Задание ещё не выполнено', 'status': job['status']}), 409
+    return send_file(os.path.abspath(job_store.path(job_id, 'result.csv')),
+                     mimetype='text/csv',
+                     as_attachment=True,
+                     download_name='predictions.csv')
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def job_delete(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задание не найдено или срок хранения истёк'}), 404
+    if job['status'] == RUNNING:
+        return jsonify({'error': 'Задание выполняется'}), 409
+    job_store.delete(job_id)
+    return '', 204
+
+
 @app.route('/download_results')
 def download_results():
-    try:
-        return send_file('results.csv',
-                         mimetype='text/csv',
-                         as_attachment=True,
-                         download_name='predictions.csv')
-    except Exception as e:
-        logger.error(f"Ошибка скачивания файла: {e}")
-        return jsonify({'error': str(e)}), 500
+    # Общего results.csv больше нет: результат скачивается по номеру задания.
+    job_id = request.args.get('job')
+    if not job_id:
+        return jsonify({'error': 'Не указано задание (?job=...)'}), 400
+    return job_download(job_id)
 
 
 if __name__ == '__main__':
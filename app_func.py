@@ -1,28 +1,92 @@
 import joblib
 import json
+import os
 import pickle
+import threading
+import numpy as np
 import pandas as pd
 import logging
 from typing import Dict
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+import model_client
+from compiled_models import load_compiled
+from log_config import get_logger, log_event
+from prediction_cache import prediction_cache
+from rank_bundle import load_rank_bundle
+from rank_index import RankIndex
+
+logger = get_logger(__name__)
+
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'compiled')
+
+
+def load_model(path: str, compiled_path: str = None):
+    if compiled_path and INFERENCE_BACKEND == 'compiled':
+        model = load_compiled(compiled_path, path)
+        if model is not None:
+            logger.info(f"Используется скомпилированная модель {compiled_path}")
+            return model
+    return joblib.load(path)
+
+
+class RemoteModel:
+    # Модель, которую считает сервер моделей (model_client.py). В процесс она
+    # загружается только если сервер недоступен.
+    def __init__(self, education_level: str, features, load):
+        self.education_level = education_level
+        self.features = features
+        self._load = load
+        self._model = None
+        self._lock = threading.Lock()
+
+    def local(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    logger.warning(f"Модель {self.education_level} загружается в процесс")
+                    self._model = self._load()
+        return self._model
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = X.to_numpy(dtype=np.float64) if isinstance(X, pd.DataFrame) else np.asarray(X, dtype=np.float64)
+        client = model_client.client
+        try:
+            if client is None:
+                raise model_client.ModelServerError("сервер моделей отключён")
+            proba = client.predict(self.education_level, X, self.features)
+        except model_client.ModelServerError as e:
+            log_event(logger, "Сервер моделей недоступен, предсказание в процессе", logging.WARNING,
+                      education_level=self.education_level, error=str(e))
+            proba = predict_positive(self.local(), X, self.features)
+        return np.column_stack([1 - proba, proba])
+
+
+def model_source(education_level: str, features, path: str, compiled_path: str = None):
+    def load():
+        return load_model(path, compiled_path)
+
+    if model_client.client is None:
+        return load()
+    logger.info(f"Модель {education_level} считается сервером моделей {model_client.client.url}")
+    return RemoteModel(education_level, features, load)
 
 
 def load_models():
     try:
-        model_bak = joblib.load('models/rf_model_s_bak_spec_mah.joblib')
         with open('models/rf_model_s_bak_spec_mah_config.json', 'r') as f:
             config_bak = json.load(f)
         with open('models/rf_model_s_bak_spec_mah_columns.pkl', 'rb') as f:
             features_bak_spec = pickle.load(f)
+        model_bak = model_source('bak_spec', features_bak_spec, 'models/rf_model_s_bak_spec_mah.joblib',
+                                 'models/rf_model_s_bak_spec_mah_compiled.npz')
 
-        model_mag = joblib.load('models/linear_model_nystroem_s_magistr_lof.joblib')
         with open('models/linear_model_nystroem_s_magistr_lof_config.json', 'r') as n:
             config_mag = json.load(n)
         with open('models/linear_model_nystroem_s_magistr_lof_columns.pkl', 'rb') as n:
             features_mag = pickle.load(n)
-            logger.info(f"mag {features_mag}")
+            log_event(logger, "Признаки модели магистратуры загружены", logging.DEBUG, features=len(features_mag))
+        model_mag = model_source('magistr', features_mag, 'models/linear_model_nystroem_s_magistr_lof.joblib',
+                                 'models/linear_model_nystroem_s_magistr_lof_compiled.npz')
 
         return (model_bak, config_bak['threshold'], features_bak_spec,
                 model_mag, config_mag['threshold'], features_mag)
@@ -33,16 +97,14 @@ def load_models():
 
 
 def load_rank_data():
+    # Дисциплины и штрафы — из наборов rank_bundle.py, распределение штрафов —
+    # из индекса рангов (rank_index.py), если он создан.
     try:
-        with open('models/subject_stats_magistr.pkl', 'rb') as f:
-            stats_mag = pickle.load(f)
-        with open('models/sorted_penalties_magistr.pkl', 'rb') as f:
-            penalties_mag = pickle.load(f)
+        stats_mag = load_rank_bundle('magistr')
+        penalties_mag = RankIndex.load('magistr', fallback=stats_mag.penalties)
 
-        with open('models/subject_stats_bak_spec.pkl', 'rb') as f:
-            stats_bak = pickle.load(f)
-        with open('models/sorted_penalties_bak_spec.pkl', 'rb') as f:
-            penalties_bak = pickle.load(f)
+        stats_bak = load_rank_bundle('bak_spec')
+        penalties_bak = RankIndex.load('bak_spec', fallback=stats_bak.penalties)
 
         return stats_mag, penalties_mag, stats_bak, penalties_bak
 
@@ -51,16 +113,30 @@ def load_rank_data():
         raise
 
 
-def make_prediction(df: pd.DataFrame, model, threshold, features) -> Dict:
+def make_prediction(df: pd.DataFrame, model, threshold, features, cache_scope=None) -> Dict:
     missing = set(features) - set(df.columns)
     if missing:
         raise ValueError(f"Отсутствуют обязательные фичи: {missing}")
 
-    if hasattr(model, 'predict_proba'):
-        proba = model.predict_proba(df[features])[:, 1]
+    proba = predict_frame(df, model, features, cache_scope)
+    return prediction_summary(proba, threshold)
+
+
+def make_prediction_row(X: np.ndarray, model, threshold, features, cache_scope=None) -> Dict:
+    # Строки признаков уже в порядке features (form_schema): без DataFrame.
+    if X.shape[1] != len(features):
+        raise ValueError(f"Ожидалось {len(features)} признаков, получено {X.shape[1]}")
+
+    if cache_scope is None:
+        proba = predict_positive(model, X, features)
     else:
-        proba = model.predict(df[features])
+        education_level, version = cache_scope
+        proba = prediction_cache.predict(education_level, version, X,
+                                         lambda rows: predict_positive(model, rows, features))
+    return prediction_summary(proba, threshold)
 
+
+def prediction_summary(proba: np.ndarray, threshold) -> Dict:
     if len(proba) > 1:
         probability = float(proba.mean())
     else:
@@ -68,13 +144,31 @@ def make_prediction(df: pd.DataFrame, model, threshold, features) -> Dict:
 
     recommendation = "more" if probability >= threshold else "less"
 
-    logger.info(f"Вероятность: {probability}, решение: {recommendation}")
+    log_event(logger, "Предсказание по форме", probability=round(probability, 4), recommendation=recommendation)
 
     return {'probability': round(probability * 100, 2), 'recommendation': recommendation}
 
 
-def save_results(df: pd.DataFrame, result: Dict):
-    df_copy = df.copy()
-    df_copy['Вероятность'] = result['probability']
-    df_copy['Рекомендация'] = result['recommendation']
-    df_copy.to_csv('results.csv', index=False)
\ No newline at end of file
+def predict_positive(model, X: np.ndarray, features) -> np.ndarray:
+    # sklearn-пайплайны обучены на DataFrame и проверяют имена признаков,
+    # скомпилированным моделям достаточно массива в порядке features.
+    if hasattr(model, 'feature_names_in_'):
+        X = pd.DataFrame(X, columns=features)
+
+    if hasattr(model, 'predict_proba'):
+        return model.predict_proba(X)[:, 1]
+    return model.predict(X).astype(float)
+
+
+def predict_frame(df: pd.DataFrame, model, features, cache_scope=None) -> np.ndarray:
+    # cache_scope = (education_level, версия артефактов): предсказания берутся
+    # из общего кэша, повторяющиеся строки считаются один раз.
+    if cache_scope is None:
+        if hasattr(model, 'predict_proba'):
+            return model.predict_proba(df[features])[:, 1]
+        return model.predict(df[features])
+
+    education_level, version = cache_scope
+    X = df[features].to_numpy(dtype=np.float64)
+    return prediction_cache.predict(education_level, version, X,
+                                    lambda rows: predict_positive(model, rows, features))
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+import time
+
+from app_func import load_models, load_rank_data
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+ARTIFACT_FILES = [
+    'models/rf_model_s_bak_spec_mah.joblib',
+    'models/rf_model_s_bak_spec_mah_compiled.npz',
+    'models/rf_model_s_bak_spec_mah_config.json',
+    'models/rf_model_s_bak_spec_mah_columns.pkl',
+    'models/linear_model_nystroem_s_magistr_lof.joblib',
+    'models/linear_model_nystroem_s_magistr_lof_compiled.npz',
+    'models/linear_model_nystroem_s_magistr_lof_config.json',
+    'models/linear_model_nystroem_s_magistr_lof_columns.pkl',
+    # Данные рангов читаются только из наборов и индекса (load_rank_data);
+    # subject_stats_*.pkl и sorted_penalties_*.pkl нужны лишь для rank_bundle.py convert.
+    'models/rank_bundle_magistr.npz',
+    'models/rank_bundle_bak_spec.npz',
+    'models/rank_index_magistr.npz',
+    'models/rank_index_magistr.log',
+    'models/rank_index_bak_spec.npz',
+    'models/rank_index_bak_spec.log',
+]
+CHECK_INTERVAL = float(os.environ.get('ARTIFACTS_CHECK_INTERVAL', 5))
+
+
+class Artifacts:
+    def __init__(self, models, rank_data, version: str):
+        (self.model_bak, self.threshold_bak, self.features_bak_spec,
+         self.model_mag, self.threshold_mag, self.features_mag) = models
+        self.stats_mag, self.penalties_mag, self.stats_bak, self.penalties_bak = rank_data
+        self.version = version
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def model(self, education_level: str):
+        if education_level == 'bak_spec':
+            return self.model_bak, self.threshold_bak, self.features_bak_spec
+        return self.model_mag, self.threshold_mag, self.features_mag
+
+    def features(self, education_level: str):
+        return self.features_bak_spec if education_level == 'bak_spec' else self.features_mag
+
+    def rank_data(self, education_level: str):
+        if education_level == 'bak_spec':
+            return self.stats_bak, self.penalties_bak
+        return self.stats_mag, self.penalties_mag
+
+    def derived(self, key, build):
+        # Производные структуры (массивы для ранжирования и т.п.) живут столько же,
+        # сколько и снимок артефактов, и пересобираются после горячей замены.
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = build()
+            return self._derived[key]
+
+
+def _file_state(files):
+    state = {}
+    for path in files:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            state[path] = None
+            continue
+        state[path] = (st.st_mtime_ns, st.st_size)
+    return state
+
+
+def _files_version(files) -> str:
+    digest = hashlib.sha256()
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+class ArtifactRegistry:
+    def __init__(self, files=None, check_interval: float = CHECK_INTERVAL):
+        self.files = list(files or ARTIFACT_FILES)
+        self.check_interval = check_interval
+        self._current = None
+        self._state = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Artifacts:
+        current = self._current
+        if current is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return current
+
+        with self._lock:
+            if self._current is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._current
+            try:
+                self._refresh()
+            except Exception as e:
+                if self._current is None:
+                    raise
+                logger.error(f"Ошибка обновления артефактов, продолжаем со старой версией: {e}")
+            self._checked_at = time.monotonic()
+            return self._current
+
+    def reload(self) -> Artifacts:
+        with self._lock:
+            self._state = None
+            self._refresh()
+            self._checked_at = time.monotonic()
+            return self._current
+
+    def _refresh(self):
+        state = _file_state(self.files)
+        if self._current is not None and state == self._state:
+            return
+
+        started = time.perf_counter()
+        artifacts = Artifacts(load_models(), load_rank_data(), _files_version(self.files))
+        # Состояние берётся до загрузки: если файлы поменялись во время чтения,
+        # следующая проверка загрузит их ещё раз.
+        self._state = state
+        self._current = artifacts
+        logger.info(f"Артефакты загружены, версия {artifacts.version}, "
+                    f"{time.perf_counter() - started:.2f} с")
+
+
+registry = ArtifactRegistry()
+
+
+def get_artifacts() -> Artifacts:
+    return registry.get()
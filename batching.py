@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 2))
+BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', 4096))
+STATS_WINDOW = 1024
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_wait_ms: float = BATCH_MAX_WAIT_MS, max_rows: int = BATCH_MAX_ROWS):
+        # run_batch(X) -> awaitable с вероятностями для всех строк X
+        self.run_batch = run_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_rows = max_rows
+        self._pending = []
+        self._pending_rows = 0
+        self._timer = None
+
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self._batch_rows = deque(maxlen=STATS_WINDOW)
+        self._batch_requests = deque(maxlen=STATS_WINDOW)
+        self._queue_waits = deque(maxlen=STATS_WINDOW)
+
+    async def submit(self, X: np.ndarray) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((X, future, time.perf_counter()))
+        self._pending_rows += len(X)
+
+        if self._pending_rows >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending, self._pending_rows = self._pending, [], 0
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        started = time.perf_counter()
+        sizes = [len(X) for X, _, _ in batch]
+        self.batches += 1
+        self.requests += len(batch)
+        self.rows += sum(sizes)
+        self._batch_rows.append(sum(sizes))
+        self._batch_requests.append(len(batch))
+        self._queue_waits.extend(started - enqueued for _, _, enqueued in batch)
+
+        try:
+            X = batch[0][0] if len(batch) == 1 else np.concatenate([X for X, _, _ in batch])
+            predictions = await self.run_batch(X)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), part in zip(batch, np.split(predictions, np.cumsum(sizes)[:-1])):
+            if not future.done():
+                future.set_result(part)
+
+    def stats(self) -> dict:
+        batch_rows = list(self._batch_rows)
+        waits_ms = [wait * 1000 for wait in self._queue_waits]
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "rows": self.rows,
+            "avg_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+            "batch_rows": {
+                "avg": float(np.mean(batch_rows)) if batch_rows else 0.0,
+                "p50": _percentile(batch_rows, 50),
+                "p95": _percentile(batch_rows, 95),
+                "max": max(batch_rows, default=0),
+            },
+            "queue_wait_ms": {
+                "p50": _percentile(waits_ms, 50),
+                "p95": _percentile(waits_ms, 95),
+                "p99": _percentile(waits_ms, 99),
+            },
+            "max_wait_ms": self.max_wait * 1000,
+            "max_rows": self.max_rows,
+        }
@@ -0,0 +1,94 @@
+
+import numpy as np
+import pandas as pd
+
+from csv_func import DEBT_GRADES, HDI_DICT, IS_NA
+from ingest import read_example
+from rank_bundle import load_rank_bundle
+
+# Синтетические когорты по образцу static/examples: те же столбцы и значения,
+# расширенные справочниками, которые понимает csv_func, и реальными
+# дисциплинами из статистики предметов.
+SUBJECT_COLUMNS = ['Наименование дисциплины', 'Оценка', 'Баллы', 'Количество пересдач']
+NUMERIC_RANGES = {
+    'priority': (1, 10),
+    'exam_score': (0, 310),
+    'achievement': (0, 10),
+    'age': (17, 35),
+}
+EXTRA_VALUES = {
+    'country': list(HDI_DICT),
+    'competition': ['Основные места', 'Особая квота', 'Отдельная квота', 'Целевая квота'],
+    'Тип олимпиады': ['Не писал', 'всероссийская олимпиада школьников (ВОШ)',
+                      'олимпиада из перечня, утвержденного МОН РФ (ОШ)'],
+    'form': ['Очная', 'Заочная', 'Очно-заочная'],
+    'level': ['Бакалавр', 'Специалист'],
+    'Тип законченного учреждения': ['Школа', 'СПО', 'Высшее', 'Профильная Школа', 'Военное уч. заведение'],
+    'benefit': ['Нет', 'Сироты', 'Инвалиды', 'Боевые действия', 'Квота для иностранных граждан'],
+    'direction': ['09.03.01', '10.05.02', '10.05.03', '11.03.04', '27.03.03', '29.03.02'],
+}
+# Числовые оценки с диапазонами баллов и зачёты/долги без баллов.
+GRADE_SCORES = {'5': (85, 100), '4': (70, 84), '3': (50, 69), '2': (0, 49)}
+TEXT_GRADES = sorted(set(IS_NA) - set(GRADE_SCORES)) + DEBT_GRADES[:-1]
+NUMERIC_GRADE_SHARE = 0.8
+MISSING_SCORE_SHARE = 0.2
+
+
+def load_template(education_level: str) -> pd.DataFrame:
+    return read_example(education_level)
+
+
+def subject_names(education_level: str, template: pd.DataFrame) -> list:
+    known = load_rank_bundle(education_level).subjects
+    unknown = [name for name in template['Наименование дисциплины'].dropna().unique() if name not in known]
+    return known + unknown
+
+
+def generate_cohort(education_level: str, n_rows: int, seed: int = 0,
+                    subjects_per_student: tuple = (4, 16)) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    template = load_template(education_level)
+
+    low, high = subjects_per_student
+    counts = rng.integers(low, high + 1, size=n_rows // low + 1)
+    total = np.cumsum(counts)
+    n_students = int(np.searchsorted(total, n_rows)) + 1
+    counts = counts[:n_students]
+    counts[-1] -= total[n_students - 1] - n_rows
+
+    columns = {'id_студента': np.repeat(np.arange(1, n_students + 1), counts)}
+    for col in template.columns:
+        if col == 'id_студента' or col in SUBJECT_COLUMNS:
+            continue
+        observed = template[col].dropna().unique().tolist()
+        if col in NUMERIC_RANGES:
+            values = rng.integers(*NUMERIC_RANGES[col], endpoint=True, size=n_students)
+        elif set(observed) <= {0, 1}:
+            values = rng.integers(0, 2, size=n_students)
+        else:
+            pool = list(dict.fromkeys(observed + EXTRA_VALUES.get(col, [])))
+            values = np.asarray(pool, dtype=object)[rng.integers(0, len(pool), size=n_students)]
+        columns[col] = np.repeat(values, counts)
+
+    subjects = np.asarray(subject_names(education_level, template), dtype=object)
+    columns['Наименование дисциплины'] = subjects[rng.integers(0, len(subjects), size=n_rows)]
+
+    numeric = rng.random(n_rows) < NUMERIC_GRADE_SHARE
+    grade_keys = np.asarray(list(GRADE_SCORES), dtype=object)
+    grade_index = rng.integers(0, len(grade_keys), size=n_rows)
+    grades = np.where(numeric, grade_keys[grade_index],
+                      np.asarray(TEXT_GRADES, dtype=object)[rng.integers(0, len(TEXT_GRADES), size=n_rows)])
+    lows = np.array([GRADE_SCORES[g][0] for g in grade_keys])[grade_index]
+    highs = np.array([GRADE_SCORES[g][1] for g in grade_keys])[grade_index]
+    scores = rng.integers(lows, highs, endpoint=True).astype(float)
+    scores[~numeric | (rng.random(n_rows) < MISSING_SCORE_SHARE)] = np.nan
+
+    columns['Оценка'] = grades
+    columns['Баллы'] = scores
+    columns['Количество пересдач'] = np.minimum(rng.poisson(0.3, size=n_rows), 5)
+
+    return pd.DataFrame(columns)[list(template.columns)]
+
+
+def cohort_csv(df: pd.DataFrame, encoding: str = 'utf-8') -> bytes:
+    return df.to_csv(sep=';', index=False).encode(encoding)
@@ -0,0 +1,171 @@
+import argparse
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import MultiDict
+
+from benchmarks.cohort import SUBJECT_COLUMNS, cohort_csv, generate_cohort
+
+# Замеры этапов обработки на синтетических когортах:
+#   python -m benchmarks.run --rows 1000 10000 100000 --save benchmarks/baselines/local.json
+#   python -m benchmarks.run --compare benchmarks/baselines/reference.json
+DEFAULT_ROWS = [1000, 10000, 100000]
+LEVELS = ['magistr', 'bak_spec']
+FORM_SAMPLES = 200
+REGRESSION_RATIO = 1.2
+# Этапы короче пары миллисекунд слишком шумные для сравнения по отношению.
+NOISE_FLOOR_S = 0.002
+
+
+def measure(func, repeat: int):
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return result, {'min_s': min(times), 'median_s': statistics.median(times)}
+
+
+def student_forms(df: pd.DataFrame, education_level: str, limit: int) -> list:
+    prefix = 'b_' if education_level == 'bak_spec' else 'm_'
+    student_columns = [col for col in df.columns if col not in SUBJECT_COLUMNS and col != 'id_студента']
+    forms = []
+    for _, rows in df.groupby('id_студента', sort=False):
+        first = rows.iloc[0]
+        form = MultiDict({col: str(first[col]) for col in student_columns})
+        form.setlist(f'{prefix}subject_name[]', rows['Наименование дисциплины'].tolist())
+        form.setlist(f'{prefix}subject_grade[]', rows['Оценка'].tolist())
+        form.setlist(f'{prefix}subject_score[]', ['' if pd.isna(v) else str(int(v)) for v in rows['Баллы']])
+        form.setlist(f'{prefix}subject_retakes[]', rows['Количество пересдач'].astype(str).tolist())
+        forms.append(form)
+        if len(forms) == limit:
+            break
+    return forms
+
+
+def bench_level(education_level: str, n_rows: int, repeat: int, artifacts) -> dict:
+    from csv_func import calculate_student_ranks, collect_form_data, prepare_data
+    from form_schema import form_schema
+    from ingest import read_upload
+    from prediction import make_prediction_csv, process_student_csv
+
+    model, threshold, features = artifacts.model(education_level)
+    features_mag, features_bak_spec = artifacts.features_mag, artifacts.features_bak_spec
+    level_name = 'Магистр' if education_level == 'magistr' else 'Бакалавр'
+
+    cohort = generate_cohort(education_level, n_rows)
+    data = cohort_csv(cohort)
+    stages = {}
+
+    df, stages['read_upload'] = measure(lambda: read_upload(io.BytesIO(data)), repeat)
+    df['Уровень подготовки'] = level_name
+
+    forms = student_forms(cohort, education_level, FORM_SAMPLES)
+    _, timing = measure(lambda: [collect_form_data(form, education_level, features_mag, features_bak_spec, artifacts)
+                                 for form in forms], repeat)
+    stages['collect_form_data'] = {key: value / len(forms) for key, value in timing.items()}
+    stages['collect_form_data']['per'] = 'student'
+
+    schema = form_schema(artifacts, education_level)
+    _, timing = measure(lambda: [schema.row(form) for form in forms], repeat)
+    stages['form_row'] = {key: value / len(forms) for key, value in timing.items()}
+    stages['form_row']['per'] = 'student'
+
+    _, stages['calculate_student_ranks'] = measure(lambda: calculate_student_ranks(df, artifacts), repeat)
+    processed, stages['process_student_csv'] = measure(
+        lambda: process_student_csv(df, education_level, features_mag, features_bak_spec, artifacts), repeat)
+    # prepare_data меняет столбцы на месте: каждый повтор получает свою копию,
+    # сделанную до замера, иначе повторы считают уже преобразованный кадр.
+    copies = [processed.copy() for _ in range(repeat)]
+    prepared, stages['prepare_data'] = measure(
+        lambda: prepare_data(copies.pop(), education_level, features_mag, features_bak_spec), repeat)
+    result, stages['make_prediction_csv'] = measure(
+        lambda: make_prediction_csv(prepared, model, threshold, features), repeat)
+    _, stages['to_csv'] = measure(lambda: result.to_csv(index=False, sep=';').encode('utf-8'), repeat)
+
+    return {'rows': n_rows, 'students': int(processed.shape[0]), 'csv_bytes': len(data), 'stages': stages}
+
+
+def environment(artifacts) -> dict:
+    import sklearn
+
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'artifacts_version': artifacts.version,
+        'models': {level: type(artifacts.model(level)[0]).__name__ for level in LEVELS},
+    }
+
+
+def compare(current: dict, baseline: dict, max_ratio: float) -> bool:
+    ok = True
+    print(f"\n{'уровень':<10}{'строк':>9}  {'этап':<25}{'база, с':>12}{'сейчас, с':>12}{'x':>8}")
+    for level, sizes in current['results'].items():
+        for rows, result in sizes.items():
+            base = baseline.get('results', {}).get(level, {}).get(rows)
+            if base is None:
+                continue
+            for stage, timing in result['stages'].items():
+                if stage not in base['stages']:
+                    continue
+                before, after = base['stages'][stage]['min_s'], timing['min_s']
+                ratio = after / before if before else float('inf')
+                mark = '  РЕГРЕССИЯ' if ratio > max_ratio and after - before > NOISE_FLOOR_S else ''
+                ok = ok and not mark
+                print(f"{level:<10}{rows:>9}  {stage:<25}{before:>12.4f}{after:>12.4f}{ratio:>8.2f}{mark}")
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры этапов обработки на синтетических когортах")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="строк оценок в когорте")
+    parser.add_argument('--levels', nargs='+', default=LEVELS, choices=LEVELS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help="записать результаты в JSON")
+    parser.add_argument('--compare', help="сравнить с сохранённым JSON")
+    parser.add_argument('--max-ratio', type=float, default=REGRESSION_RATIO,
+                        help="во сколько раз этап может замедлиться без ошибки")
+    args = parser.parse_args(argv)
+
+    # Логи на каждого студента искажают замеры.
+    logging.disable(logging.WARNING)
+
+    from artifacts import get_artifacts
+
+    artifacts = get_artifacts()
+    report = {'environment': environment(artifacts), 'results': {}}
+    for level in args.levels:
+        report['results'][level] = {}
+        for n_rows in args.rows:
+            result = bench_level(level, n_rows, args.repeat, artifacts)
+            report['results'][level][str(n_rows)] = result
+            print(f"{level} {n_rows} строк, {result['students']} студентов")
+            for stage, timing in result['stages'].items():
+                per = timing.get('per', 'cohort')
+                print(f"  {stage:<25}{timing['min_s']:>10.4f} с (медиана {timing['median_s']:.4f}) на {per}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        return 0 if compare(report, baseline, args.max_ratio) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
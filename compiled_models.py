@@ -0,0 +1,394 @@
+import hashlib
+import os
+import struct
+import sys
+import threading
+import zipfile
+
+import numpy as np
+
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+FORMAT_VERSION = 1
+BLOCK_ROWS = 4096
+MODEL_MMAP = os.environ.get('MODEL_MMAP', '1') == '1'
+
+
+def file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _as_matrix(X, feature_names) -> np.ndarray:
+    if hasattr(X, 'columns'):
+        X = X[list(feature_names)]
+    return np.asarray(X, dtype=np.float64)
+
+
+def _round_down_float32(values: np.ndarray) -> np.ndarray:
+    # Для float32 x сравнение x <= t равносильно x <= (наибольшее float32, не
+    # превосходящее t), поэтому порог можно хранить в float32 без потери точности.
+    rounded = values.astype(np.float32)
+    too_big = rounded.astype(np.float64) > values
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+
+class CompiledForest:
+    kind = 'forest'
+    verify_atol = 0.0
+
+    def __init__(self, arrays):
+        self.feature_names = [str(name) for name in arrays['feature_names']]
+        self.classes_ = np.asarray(arrays['classes'])
+        self.mean = np.asarray(arrays['mean'], dtype=np.float64)
+        self.scale = np.asarray(arrays['scale'], dtype=np.float64)
+        self.roots = np.asarray(arrays['roots'], dtype=np.int32)
+        self.feature = np.asarray(arrays['feature'], dtype=np.int32)
+        self.threshold = np.asarray(arrays['threshold'], dtype=np.float32)
+        self.children = np.asarray(arrays['children'], dtype=np.int32)
+        self.proba = np.asarray(arrays['proba'], dtype=np.float64)
+        self.max_depth = int(arrays['max_depth'])
+        self.source_sha256 = str(arrays['source_sha256'])
+        self.n_features_in_ = len(self.feature_names)
+
+    @classmethod
+    def from_pipeline(cls, pipeline, source_sha256: str = ''):
+        scaler = pipeline.named_steps['scaler']
+        forest = pipeline.named_steps['clf']
+
+        roots, feature, threshold, left, right, proba = [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            ids = np.arange(n_nodes, dtype=np.int64) + offset
+            is_leaf = tree.children_left == -1
+
+            # Листья замкнуты сами на себя, чтобы обход шёл фиксированное число шагов.
+            roots.append(offset)
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, ids, tree.children_left + offset))
+            right.append(np.where(is_leaf, ids, tree.children_right + offset))
+
+            # Начиная с sklearn 1.4 tree_.value уже хранит доли классов, и
+            # DecisionTreeClassifier.predict_proba возвращает их без нормировки.
+            proba.append(tree.value[:, 0, :forest.n_classes_])
+            offset += n_nodes
+
+        return cls({
+            'feature_names': np.asarray(pipeline.feature_names_in_, dtype=str),
+            'classes': forest.classes_,
+            'mean': scaler.mean_ if scaler.with_mean else np.zeros(scaler.n_features_in_),
+            'scale': scaler.scale_ if scaler.with_std else np.ones(scaler.n_features_in_),
+            'roots': np.asarray(roots),
+            'feature': np.concatenate(feature),
+            'threshold': _round_down_float32(np.concatenate(threshold)),
+            'children': np.stack([np.concatenate(left), np.concatenate(right)]),
+            'proba': np.concatenate(proba),
+            'max_depth': max(estimator.tree_.max_depth for estimator in forest.estimators_),
+            'source_sha256': source_sha256,
+        })
+
+    def arrays(self):
+        return {
+            'format_version': FORMAT_VERSION,
+            'kind': self.kind,
+            'feature_names': np.asarray(self.feature_names, dtype=str),
+            'classes': self.classes_,
+            'mean': self.mean,
+            'scale': self.scale,
+            'roots': self.roots,
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'children': self.children,
+            'proba': self.proba,
+            'max_depth': self.max_depth,
+            'source_sha256': self.source_sha256,
+        }
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = _as_matrix(X, self.feature_names)
+        result = np.empty((X.shape[0], self.proba.shape[1]), dtype=np.float64)
+        for start in range(0, X.shape[0], BLOCK_ROWS):
+            result[start:start + BLOCK_ROWS] = self._predict_block(X[start:start + BLOCK_ROWS])
+        return result
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        # Как в sklearn: масштабирование в float64, сравнение в float32.
+        X = ((X - self.mean) / self.scale).astype(np.float32)
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        left, right = self.children
+        for _ in range(self.max_depth):
+            values = np.take_along_axis(X, self.feature[nodes], axis=1)
+            nodes = np.where(values <= self.threshold[nodes], left[nodes], right[nodes])
+
+        # Деревья суммируются по порядку, как RandomForestClassifier.predict_proba.
+        return np.cumsum(self.proba[nodes], axis=1)[:, -1] / len(self.roots)
+
+
+class CompiledNystroem:
+    kind = 'nystroem'
+    verify_atol = 1e-9
+
+    def __init__(self, arrays):
+        self.feature_names = [str(name) for name in arrays['feature_names']]
+        self.classes_ = np.asarray(arrays['classes'])
+        self.mean = np.asarray(arrays['mean'], dtype=np.float64)
+        self.scale = np.asarray(arrays['scale'], dtype=np.float64)
+        self.components_t = np.ascontiguousarray(arrays['components_t'], dtype=np.float64)
+        self.components_sq = np.asarray(arrays['components_sq'], dtype=np.float64)
+        self.gamma = float(arrays['gamma'])
+        self.weights = np.asarray(arrays['weights'], dtype=np.float64)
+        self.intercept = float(arrays['intercept'])
+        self.source_sha256 = str(arrays['source_sha256'])
+        self.n_features_in_ = len(self.feature_names)
+        self._local = threading.local()
+
+    @classmethod
+    def from_pipeline(cls, pipeline, source_sha256: str = ''):
+        scaler = pipeline.named_steps['scaler']
+        kernel = pipeline.named_steps['kernel']
+        linear = pipeline.named_steps['clf']
+        if kernel.kernel != 'rbf' or linear.coef_.shape[0] != 1:
+            raise ValueError("Поддерживается только rbf-ядро и бинарная логистическая регрессия")
+
+        gamma = kernel.gamma if kernel.gamma is not None else 1.0 / kernel.components_.shape[1]
+        components = kernel.components_
+        return cls({
+            'feature_names': np.asarray(pipeline.feature_names_in_, dtype=str),
+            'classes': linear.classes_,
+            'mean': scaler.mean_ if scaler.with_mean else np.zeros(scaler.n_features_in_),
+            'scale': scaler.scale_ if scaler.with_std else np.ones(scaler.n_features_in_),
+            'components_t': components.T,
+            'components_sq': (components ** 2).sum(axis=1),
+            'gamma': gamma,
+            # Проекция Нистрёма и линейная голова сворачиваются в один вектор весов.
+            'weights': kernel.normalization_.T @ linear.coef_[0],
+            'intercept': linear.intercept_[0],
+            'source_sha256': source_sha256,
+        })
+
+    def arrays(self):
+        return {
+            'format_version': FORMAT_VERSION,
+            'kind': self.kind,
+            'feature_names': np.asarray(self.feature_names, dtype=str),
+            'classes': self.classes_,
+            'mean': self.mean,
+            'scale': self.scale,
+            'components_t': self.components_t,
+            'components_sq': self.components_sq,
+            'gamma': self.gamma,
+            'weights': self.weights,
+            'intercept': self.intercept,
+            'source_sha256': self.source_sha256,
+        }
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = _as_matrix(X, self.feature_names)
+        result = np.empty((X.shape[0], 2), dtype=np.float64)
+        for start in range(0, X.shape[0], BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            positive = self._predict_block(block)
+            result[start:start + len(block), 1] = positive
+            result[start:start + len(block), 0] = 1 - positive
+        return result
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def _buffers(self, n_rows: int):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = (
+                np.empty((BLOCK_ROWS, len(self.mean))),
+                np.empty((BLOCK_ROWS, len(self.components_sq))),
+                np.empty(BLOCK_ROWS),
+                np.empty(BLOCK_ROWS),
+            )
+            self._local.buffers = buffers
+        return tuple(buffer[:n_rows] for buffer in buffers)
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        # Масштабирование, rbf-ядро к опорным точкам, проекция и логистическая
+        # функция считаются в заранее выделенных буферах потока, без промежуточных
+        # массивов sklearn. Расстояния -- как в euclidean_distances.
+        scaled, kernel, norms, logits = self._buffers(X.shape[0])
+        np.subtract(X, self.mean, out=scaled)
+        np.divide(scaled, self.scale, out=scaled)
+
+        np.einsum('ij,ij->i', scaled, scaled, out=norms)
+        np.dot(scaled, self.components_t, out=kernel)
+        kernel *= -2
+        kernel += norms[:, np.newaxis]
+        kernel += self.components_sq
+        np.maximum(kernel, 0, out=kernel)
+        kernel *= -self.gamma
+        np.exp(kernel, out=kernel)
+
+        np.dot(kernel, self.weights, out=logits)
+        logits += self.intercept
+        np.negative(logits, out=logits)
+        np.exp(logits, out=logits)
+        logits += 1
+        np.reciprocal(logits, out=logits)
+        return logits
+
+
+COMPILED_KINDS = {CompiledForest.kind: CompiledForest, CompiledNystroem.kind: CompiledNystroem}
+
+COMPILED_MODELS = {
+    'bak_spec': ('models/rf_model_s_bak_spec_mah.joblib', 'models/rf_model_s_bak_spec_mah_compiled.npz',
+                 CompiledForest),
+    'magistr': ('models/linear_model_nystroem_s_magistr_lof.joblib',
+                'models/linear_model_nystroem_s_magistr_lof_compiled.npz', CompiledNystroem),
+}
+
+
+def save_compiled(model, path: str):
+    # Рабочие процессы держат старый файл отображённым в память (mmap_npz):
+    # новый пишется рядом и подменяет его целиком, старый inode не меняется.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **model.arrays())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def mmap_npz(path: str):
+    # np.savez пишет члены архива без сжатия, поэтому массивы можно отобразить
+    # в память прямо из .npz: процессы делят одни и те же страницы кэша ОС,
+    # а загрузка не копирует данные. Для сжатых архивов возвращается None.
+    arrays = {}
+    mapped = None
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'):
+                return None
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+            start = info.header_offset + 30 + name_length + extra_length
+
+            f.seek(start)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                return None
+
+            key = info.filename[:-len('.npy')]
+            if not shape or 0 in shape:
+                f.seek(start)
+                arrays[key] = np.lib.format.read_array(f, allow_pickle=False)
+            else:
+                # Одно отображение файла на все массивы архива.
+                if mapped is None:
+                    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+                arrays[key] = np.ndarray(shape, dtype=dtype, buffer=mapped, offset=f.tell(),
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load_compiled(path: str, source_path: str = None, mmap: bool = MODEL_MMAP):
+    if not os.path.exists(path):
+        return None
+
+    arrays = mmap_npz(path) if mmap else None
+    if arrays is None:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+
+    if int(arrays['format_version']) != FORMAT_VERSION:
+        logger.warning(f"Скомпилированная модель {path} в старом формате, используем исходную")
+        return None
+    if source_path is not None and str(arrays['source_sha256']) != file_sha256(source_path):
+        logger.warning(f"Скомпилированная модель {path} устарела относительно {source_path}, используем исходную")
+        return None
+
+    return COMPILED_KINDS[str(arrays['kind'])](arrays)
+
+
+def convert(education_level: str):
+    import joblib
+
+    source_path, compiled_path, kind = COMPILED_MODELS[education_level]
+    pipeline = joblib.load(source_path)
+    model = kind.from_pipeline(pipeline, file_sha256(source_path))
+    save_compiled(model, compiled_path)
+    logger.info(f"{source_path} -> {compiled_path}")
+    return pipeline, model
+
+
+def example_features(education_level: str, n_random: int = 5000, seed: int = 0) -> np.ndarray:
+    from artifacts import get_artifacts
+    from csv_func import collect_csv_data, prepare_data
+    from ingest import read_example
+
+    df = read_example(education_level).rename(columns={
+        'Наименование дисциплины': 'subject_name',
+        'Оценка': 'subject_grade',
+        'Баллы': 'subject_score',
+        'Количество пересдач': 'subject_retakes'
+    })
+    df['subject_retakes'] = df['subject_retakes'].fillna(0).astype(int)
+
+    artifacts = get_artifacts()
+    features_mag, features_bak_spec = artifacts.features_mag, artifacts.features_bak_spec
+    processed = collect_csv_data(df, education_level, features_mag, features_bak_spec, artifacts)
+    X = prepare_data(processed, education_level, features_mag, features_bak_spec).to_numpy(dtype=np.float64)
+
+    # Примеров мало, поэтому добавляем их случайные комбинации с шумом,
+    # чтобы пройти по как можно большему числу ветвей.
+    rng = np.random.default_rng(seed)
+    pool = np.concatenate([X, np.zeros((1, X.shape[1]))])
+    random = pool[rng.integers(0, len(pool), size=(n_random, X.shape[1])), np.arange(X.shape[1])]
+    random = random + rng.integers(-3, 4, size=random.shape) * rng.random(size=random.shape).round(1)
+    random[:, -1] = rng.integers(1, 2000, size=n_random)
+    return np.concatenate([X, random])
+
+
+def verify(education_level: str, pipeline=None) -> bool:
+    import joblib
+    import pandas as pd
+
+    source_path, compiled_path, kind = COMPILED_MODELS[education_level]
+    if pipeline is None:
+        pipeline = joblib.load(source_path)
+    compiled = load_compiled(compiled_path, source_path)
+    if compiled is None:
+        logger.error(f"Нет актуальной скомпилированной модели {compiled_path}")
+        return False
+
+    X = pd.DataFrame(example_features(education_level), columns=compiled.feature_names)
+    expected = pipeline.predict_proba(X)
+    actual = compiled.predict_proba(X)
+    max_diff = float(np.abs(expected - actual).max())
+    ok = expected.shape == actual.shape and max_diff <= kind.verify_atol
+    logger.info(f"{education_level}: строк {len(X)}, максимальное расхождение {max_diff:.3g}, "
+                f"{'OK' if ok else 'ОШИБКА'}")
+    return ok
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'convert'
+    levels = sys.argv[2:] or list(COMPILED_MODELS)
+    success = True
+    for level in levels:
+        if command == 'convert':
+            source, _ = convert(level)
+            success = verify(level, source) and success
+        elif command == 'verify':
+            success = verify(level) and success
+        else:
+            raise SystemExit(f"Неизвестная команда {command}, используйте convert или verify")
+    sys.exit(0 if success else 1)
@@ -1,15 +1,18 @@
+import numpy as np
 import pandas as pd
 from collections import OrderedDict
 from typing import Dict
 import logging
-import bisect
-import pickle
 import math
 import uuid
 
+from artifacts import get_artifacts
+from log_config import get_logger, log_event, log_sampled
+from metrics import timed
+from rank_index import RankIndex
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+
+logger = get_logger(__name__)
 
 HDI_DICT = {
     'Арабская Республика Египет': 0.731,
@@ -47,95 +50,147 @@ HDI_DICT = {
     'Федеративная Республика Нигерия': 0.535
 }
 IS_NA = {'зач.': 70, 'неуваж.': 0, 'недсд.': 0, '4': 70, 'недоп.': 0, '5': 90, 'незач.': 20, '2': 20, '3': 50}
+POST_SOVIET = ['Республика Беларусь', 'Республика Казахстан', 'Республика Армения',
+               'Республика Азербайджан', 'Республика Молдова', 'Республика Узбекистан',
+               'Республика Таджикистан', 'Туркменистан', 'Киргизская Республика',
+               'Украина']
+MAIN_COUNTRIES = ['Российская Федерация', 'Республика Беларусь', 'Республика Казахстан']
+DEBT_GRADES = ['Незачёт', 'Недопуск', 'Недосдал', 'Неуважительная причина', '2']
 
 
-def get_student_rank(student_penalty, sorted_penalties):
-    pos = bisect.bisect_right(sorted_penalties, student_penalty)
-    return pos + 1
-
-
-def power_penalty_score(student_scores, subject_stats, p=2.0):
-    total_score = 0
-    subject_count = 0
-
-    for subject, student_score in student_scores.items():
-        if subject not in subject_stats:
-            continue
-
-        stats = subject_stats[subject]
-        mean_clean = stats['mean_clean']
-        fail_ratio = stats['fail_ratio']
-
-        if student_score < 40:
-            multiplier = 1 + math.log(1 / (fail_ratio + 1e-6))
-            adjusted = (mean_clean ** p) * multiplier
-        else:
-            delta = mean_clean - student_score
-            adjusted = math.copysign(abs(delta) ** p, delta) * fail_ratio
-
-        total_score += adjusted
-        subject_count += 1
-
-    return total_score / subject_count if subject_count else 0.0
-
-
-def calculate_student_ranks(df):
+def parse_score(score: str):
+    try:
+        return float(score) if score.strip() != '' else None
+    except ValueError:
+        return None
+
+
+def subject_arrays(bundle, p=2.0):
+    # bundle — RankBundle (rank_bundle.py): названия и массивы уже в одном порядке.
+    mean_clean = np.asarray(bundle.mean_clean, dtype='float64')
+    fail_ratio = np.asarray(bundle.fail_ratio, dtype='float64')
+    fail_penalty = np.array([(mean ** p) * (1 + math.log(1 / (ratio + 1e-6)))
+                             for mean, ratio in zip(mean_clean.tolist(), fail_ratio.tolist())], dtype='float64')
+    return bundle.subject_index, mean_clean, fail_ratio, fail_penalty
+
+
+def power_penalty_scores(student_codes, subject_codes, scores, arrays, n_students, p=2.0):
+    _, mean_clean, fail_ratio, fail_penalty = arrays
+
+    adjusted = np.empty(len(scores), dtype='float64')
+    failed = scores < 40
+    adjusted[failed] = fail_penalty[subject_codes[failed]]
+
+    passed = ~failed
+    delta = mean_clean[subject_codes[passed]] - scores[passed]
+    # Степень считается через float.__pow__, как в исходной скалярной формуле,
+    # иначе результат расходится с эталоном в последнем бите.
+    magnitudes, inverse = np.unique(np.abs(delta), return_inverse=True)
+    powered = np.array([m ** p for m in magnitudes.tolist()], dtype='float64')[inverse]
+    adjusted[passed] = np.copysign(powered, delta) * fail_ratio[subject_codes[passed]]
+
+    totals = np.bincount(student_codes, weights=adjusted, minlength=n_students)
+    counts = np.bincount(student_codes, minlength=n_students)
+    return np.divide(totals, counts, out=np.zeros(n_students), where=counts > 0)
+
+
+def lookup_codes(values: pd.Series, mapping: Dict, default) -> pd.Series:
+    codes, uniques = pd.factorize(values)
+    table = np.array([mapping.get(value, default) for value in uniques] + [mapping.get(np.nan, default)])
+    return pd.Series(table[codes], index=values.index)
+
+
+def rank_arrays(artifacts, education_level: str):
+    def build():
+        stats, sorted_penalties = artifacts.rank_data(education_level)
+        return subject_arrays(stats), RankIndex.from_values(sorted_penalties)
+
+    return artifacts.derived(('rank_arrays', education_level), build)
+
+
+def student_penalties(df, arrays):
+    # Штраф каждого студента по строкам (id_студента, Наименование дисциплины,
+    # Оценка, Баллы): студенты в порядке первого появления.
+    df = df[df["id_студента"].notna()]
+    student_codes, students = pd.factorize(df["id_студента"])
+    if not len(students):
+        return students, np.empty(0)
+
+    points = df["Баллы"]
+    grade_points = lookup_codes(df["Оценка"], IS_NA, 0)
+    scores = points.where(points.notna(), grade_points).astype('float64').to_numpy()
+
+    index = arrays[0]
+    subject_codes = lookup_codes(df["Наименование дисциплины"], index, -1).to_numpy()
+    known = subject_codes >= 0
+    student_codes = student_codes[known]
+    subject_codes = subject_codes[known]
+    scores = scores[known]
+
+    # Как в словаре {студент: {дисциплина: балл}}: порядок по первому
+    # вхождению дисциплины, значение по последнему.
+    key_codes, unique_keys = pd.factorize(student_codes * len(index) + subject_codes)
+    last_pos = np.zeros(len(unique_keys), dtype='int64')
+    np.maximum.at(last_pos, key_codes, np.arange(len(key_codes)))
+
+    penalties = power_penalty_scores(
+        unique_keys // len(index),
+        unique_keys % len(index),
+        scores[last_pos],
+        arrays,
+        len(students)
+    )
+    return students, penalties
+
+
+def cohort_penalties(df: pd.DataFrame, arrays) -> np.ndarray:
+    # Для пополнения индекса рангов: CSV в формате загрузки.
+    def column(name, default):
+        if name in df.columns:
+            return df[name]
+        return pd.Series([default] * len(df), index=df.index, dtype=object)
+
+    subjects = pd.DataFrame({
+        "id_студента": df['id_студента'].to_numpy(),
+        "Наименование дисциплины": column('Наименование дисциплины', '').astype(str).to_numpy(),
+        "Оценка": column('Оценка', '').astype(str).to_numpy(),
+        "Баллы": _score_column(column('Баллы', '')).to_numpy(),
+    })
+    return student_penalties(subjects, arrays)[1]
+
+
+def calculate_student_ranks(df, artifacts=None):
     def sep_dataset_local(df):
         bak_spec_mask = df["Уровень подготовки"].isin(["Бакалавр", "Специалист"])
         magistr_mask = df["Уровень подготовки"] == "Магистр"
-        bak_spec = df[bak_spec_mask].copy()
-        magistr = df[magistr_mask].copy()
+        bak_spec = df[bak_spec_mask]
+        magistr = df[magistr_mask]
         return bak_spec, magistr
 
-    def group_students(df):
-        student_groups = {}
-        for _, row in df.iterrows():
-            student = row["id_студента"]
-            subject = row["Наименование дисциплины"]
-            if pd.isna(row["Баллы"]):
-                grade = row["Оценка"]
-                score = IS_NA.get(grade, 0)
-            else:
-                score = row["Баллы"]
-            if student not in student_groups:
-                student_groups[student] = {}
-            student_groups[student][subject] = score
-        return student_groups
-
-    with open('models/subject_stats_magistr.pkl', 'rb') as f:
-        stats_magistr = pickle.load(f)
-    with open('models/sorted_penalties_magistr.pkl', 'rb') as f:
-        sorted_penalties_magistr = pickle.load(f)
-
-    with open('models/subject_stats_bak_spec.pkl', 'rb') as f:
-        stats_bak_spec = pickle.load(f)
-    with open('models/sorted_penalties_bak_spec.pkl', 'rb') as f:
-        sorted_penalties_bak_spec = pickle.load(f)
+    def rank_students(df, arrays, rank_index):
+        students, penalties = student_penalties(df, arrays)
+        if not len(students):
+            return {}
+        ranks = rank_index.ranks(penalties)
+        return dict(zip(students.tolist(), ranks.tolist()))
 
+    if artifacts is None:
+        artifacts = get_artifacts()
+
+    df = df[["id_студента", "Уровень подготовки", "Наименование дисциплины", "Оценка", "Баллы"]]
     bak_spec_df, magistr_df = sep_dataset_local(df)
 
     ranks = {}
+    for level, level_df in (('magistr', magistr_df), ('bak_spec', bak_spec_df)):
+        if len(level_df):
+            with timed('ranking', level, len(level_df)):
+                ranks.update(rank_students(level_df, *rank_arrays(artifacts, level)))
 
-    magistr_students = group_students(magistr_df)
-    for student, scores in magistr_students.items():
-        penalty = power_penalty_score(scores, stats_magistr)
-        logger.info(f"ШТРАФ{penalty}")
-        rank = get_student_rank(penalty, sorted_penalties_magistr)
-        ranks[student] = rank
-
-    bak_spec_students = group_students(bak_spec_df)
-    for student, scores in bak_spec_students.items():
-        penalty = power_penalty_score(scores, stats_bak_spec)
-        logger.info(f"ШТРАФ{penalty}")
-        rank = get_student_rank(penalty, sorted_penalties_bak_spec)
-        ranks[student] = rank
-
+    log_event(logger, "Ранги рассчитаны", logging.DEBUG, students=len(ranks))
     return ranks
 
 
-def collect_form_data(form: Dict, education_level: str, features_mag, features_bak_spec) -> Dict:
-    logger.info(f"form {form}")
-
+def collect_form_data(form: Dict, education_level: str, features_mag, features_bak_spec, artifacts=None) -> Dict:
     if education_level == 'magistr':
         columns_order = features_mag
     else:
@@ -158,11 +213,8 @@ def collect_form_data(form: Dict, education_level: str, features_mag, features_b
     data['fromSverdlovskRegion'] = int(form.get('region', 0))
 
     country = form.get('country', 'Российская Федерация')
-    data['PostSoviet'] = 1 if country in ['Республика Беларусь', 'Республика Казахстан', 'Республика Армения',
-                                          'Республика Азербайджан', 'Республика Молдова', 'Республика Узбекистан',
-                                          'Республика Таджикистан', 'Туркменистан', 'Киргизская Республика',
-                                          'Украина'] else 0
-    data['others'] = 1 if country not in ['Российская Федерация', 'Республика Беларусь', 'Республика Казахстан'] else 0
+    data['PostSoviet'] = 1 if country in POST_SOVIET else 0
+    data['others'] = 1 if country not in MAIN_COUNTRIES else 0
 
     competition = form.get('competition', 'Основные места')
     data['Особая квота'] = 1 if competition == 'Особая квота' else 0
@@ -225,11 +277,7 @@ def collect_form_data(form: Dict, education_level: str, features_mag, features_b
     for i in range(len(subject_names)):
         grade = subject_grades[i] if i < len(subject_grades) else ''
         score = subject_scores[i] if i < len(subject_scores) else ''
-        score_val = None
-        try:
-            score_val = float(score) if score.strip() != '' else None
-        except ValueError:
-            pass
+        score_val = parse_score(score)
 
         rows.append({
             "id_студента": student_uuid,
@@ -242,9 +290,8 @@ def collect_form_data(form: Dict, education_level: str, features_mag, features_b
     df_student = pd.DataFrame(rows)
 
     try:
-        ranks = calculate_student_ranks(df_student)
+        ranks = calculate_student_ranks(df_student, artifacts)
         student_rank = next(iter(ranks.values())) if ranks else 1
-        logger.info(f'!!!!!!!!!!!!!!!!!!!!!!!!!RANK!!!!!!!!!!!!!!!!!!!!!!!!!!!!!{str(student_rank)}')
     except Exception as e:
         logger.error(f"Ошибка при вычислении ранга: {e}")
         student_rank = 1
@@ -257,17 +304,177 @@ def collect_form_data(form: Dict, education_level: str, features_mag, features_b
         retakes = int(subject_retakes[i]) if i < len(subject_retakes) else 0
         grade = subject_grades[i] if i < len(subject_grades) else ''
         total_retakes += retakes
-        if grade in ['Незачёт', 'Недопуск', 'Недосдал', 'Неуважительная причина', '2']:
+        if grade in DEBT_GRADES:
             total_debts += 1
 
     data['Общее количество пересдач'] = total_retakes
     data['Общее количество долгов'] = total_debts
     data['Human Development Index'] = HDI_DICT.get(country, 0.0)
 
-    logger.info(f"ghjn{data}")
+    log_sampled(logger, "Признаки из формы собраны", education_level=education_level,
+                subjects=len(subject_names), rank=student_rank)
     return data
 
 
+def _int_column(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype('int64')
+    if pd.api.types.is_float_dtype(values) and np.isfinite(values.to_numpy()).all():
+        return values.astype('int64')
+    return values.map(int).astype('int64')
+
+
+def _str_int_column(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype('int64')
+    return values.astype(str).map(int).astype('int64')
+
+
+def _score_column(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_integer_dtype(values) or pd.api.types.is_float_dtype(values):
+        return values.astype('float64')
+    return values.astype(str).map(parse_score)
+
+
+def collect_csv_data(df: pd.DataFrame, education_level: str, features_mag, features_bak_spec,
+                     artifacts=None) -> pd.DataFrame:
+    df = df[df['id_студента'].notna()]
+    if df.empty:
+        return pd.DataFrame()
+
+    codes, student_ids = pd.factorize(df['id_студента'], sort=True)
+    n_students = len(student_ids)
+    _, first_pos = np.unique(codes, return_index=True)
+    first = df.iloc[first_pos].reset_index(drop=True)
+
+    def field(name, default):
+        if name in first.columns:
+            return first[name]
+        return pd.Series([default] * n_students, dtype=object)
+
+    def flag(mask) -> np.ndarray:
+        return np.asarray(mask, dtype=bool).astype('int64')
+
+    if education_level == 'magistr':
+        columns_order = features_mag
+    else:
+        columns_order = features_bak_spec
+
+    data = OrderedDict()
+
+    for col in columns_order:
+        data[col] = None
+
+    data['Приоритет'] = _int_column(field('priority', 1)).to_numpy()
+    data['Cумма баллов испытаний'] = _int_column(field('exam_score', 0)).to_numpy()
+    data['Балл за инд. достижения'] = _int_column(field('achievement', 0)).to_numpy()
+    data['Контракт'] = _int_column(field('contract', 0)).to_numpy()
+    data['Нуждается в общежитии'] = _int_column(field('dormitory', 0)).to_numpy()
+    data['Иностранный абитуриент (МОН)'] = _int_column(field('foreign', 0)).to_numpy()
+    data['Пол'] = _int_column(field('gender', 0)).to_numpy()
+    data['Полных лет на момент поступления'] = _int_column(field('age', 15)).to_numpy()
+    data['fromEkaterinburg'] = _int_column(field('city', 0)).to_numpy()
+    data['fromSverdlovskRegion'] = _int_column(field('region', 0)).to_numpy()
+
+    country = field('country', 'Российская Федерация')
+    data['PostSoviet'] = flag(country.isin(POST_SOVIET))
+    data['others'] = flag(~country.isin(MAIN_COUNTRIES))
+
+    competition = field('competition', 'Основные места')
+    data['Особая квота'] = flag(competition == 'Особая квота')
+    data['Отдельная квота'] = flag(competition == 'Отдельная квота')
+    data['Целевая квота'] = flag(competition == 'Целевая квота')
+
+    form_type = field('form', 'Очная')
+    data['Заочная'] = flag(form_type == 'Заочная')
+    data['Очно-заочная'] = flag(form_type == 'Очно-заочная')
+
+    benefit = field('benefit', 'Нет')
+    data['Боевые действия'] = flag(benefit == 'Боевые действия')
+    data['Инвалиды'] = flag(benefit == 'Инвалиды')
+    data['Квота для иностранных граждан'] = flag(benefit == 'Квота для иностранных граждан')
+    data['Сироты'] = flag(benefit == 'Сироты')
+
+    direction = field('direction', '00.00.00')
+    not_str = ~direction.map(lambda value: isinstance(value, str))
+    if not_str.any():
+        bad = direction[not_str].iloc[0]
+        student = first.loc[not_str[not_str].index[0], 'id_студента']
+        raise ValueError(f"Некорректный код направления «{bad}» у студента {student}: "
+                         f"ожидается строка вида 00.00.00")
+    data['Код направления 1: 10'] = flag(direction.str.startswith('10'))
+    data['Код направления 1: 11'] = flag(direction.str.startswith('11'))
+    data['Код направления 1: 27'] = flag(direction.str.startswith('27'))
+    data['Код направления 1: 29'] = flag(direction.str.startswith('29'))
+    data['Код направления 3: 2'] = flag(direction.str.endswith('02'))
+    data['Код направления 3: 3'] = flag(direction.str.endswith('03'))
+    data['Код направления 3: 4'] = flag(direction.str.endswith('04'))
+
+    student_level = 'Магистр' if education_level == 'magistr' else 'Бакалавр'
+
+    if education_level != 'magistr':
+        data['БВИ'] = _int_column(field('bvi', 0)).to_numpy()
+
+        level = field('level', 'Бакалавр')
+        data['Специалист'] = flag(level != 'Бакалавр')
+
+        olympiads = field('Тип олимпиады', 'Не писал')
+        data['всероссийская олимпиада школьников (ВОШ)'] = flag(olympiads == 'всероссийская олимпиада школьников (ВОШ)')
+        data['олимпиада из перечня, утвержденного МОН РФ (ОШ)'] = flag(olympiads == 'олимпиада из перечня, утвержденного МОН РФ (ОШ)')
+
+        pre = field('Тип законченного учреждения', 'Школа')
+        data['Военное уч. заведение'] = flag(pre == 'Военное уч. заведение')
+        data['Высшее'] = flag(pre == 'Высшее')
+        data['Профильная Школа'] = flag(pre == 'Профильная Школа')
+        data['СПО'] = flag(pre == 'СПО')
+    else:
+        zeros = np.zeros(n_students, dtype='int64')
+        data['всероссийская олимпиада школьников (ВОШ)'] = zeros
+        data['олимпиада из перечня, утвержденного МОН РФ (ОШ)'] = zeros
+
+        data['Военное уч. заведение'] = zeros
+        data['Высшее'] = np.ones(n_students, dtype='int64')
+        data['Профильная Школа'] = zeros
+        data['СПО'] = zeros
+
+    def subject_column(name, default):
+        if name in df.columns:
+            return df[name]
+        return pd.Series([default] * len(df), index=df.index, dtype=object)
+
+    grades = subject_column('subject_grade', '').astype(str)
+
+    df_subjects = pd.DataFrame({
+        "id_студента": df['id_студента'].to_numpy(),
+        "Уровень подготовки": student_level,
+        "Наименование дисциплины": subject_column('subject_name', '').astype(str).to_numpy(),
+        "Оценка": grades.to_numpy(),
+        "Баллы": _score_column(subject_column('subject_score', '')).to_numpy()
+    })
+
+    try:
+        ranks = calculate_student_ranks(df_subjects, artifacts)
+        student_rank = pd.Series(student_ids).map(ranks).fillna(1).astype('int64').to_numpy()
+    except Exception as e:
+        logger.error(f"Ошибка при вычислении ранга: {e}")
+        student_rank = np.ones(n_students, dtype='int64')
+
+    data['Позиция студента в рейтинге'] = student_rank
+
+    retakes = _str_int_column(subject_column('subject_retakes', 0)).to_numpy()
+    debts = grades.isin(DEBT_GRADES).to_numpy()
+    data['Общее количество пересдач'] = np.bincount(codes, weights=retakes, minlength=n_students).astype('int64')
+    data['Общее количество долгов'] = np.bincount(codes, weights=debts, minlength=n_students).astype('int64')
+    data['Human Development Index'] = country.map(HDI_DICT).fillna(0.0).astype('float64').to_numpy()
+
+    result = pd.DataFrame({'id_студента': student_ids})
+    for col, values in data.items():
+        result[col] = values
+
+    log_event(logger, "Признаки собраны", education_level=education_level, students=n_students, rows=len(df))
+    return result
+
+
 def prepare_data(df: pd.DataFrame, education_level: str, features_mag, features_bak_spec) -> pd.DataFrame:
     if education_level == 'bak_spec':
         required_features = features_bak_spec
@@ -286,7 +493,7 @@ def prepare_data(df: pd.DataFrame, education_level: str, features_mag, features_
         raise ValueError(error_msg)
 
     if extra_in_df:
-        logger.warning(f"В данных есть лишние признаки, не используемые моделью: {extra_in_df}")
+        logger.debug("В данных есть лишние признаки, не используемые моделью: %s", sorted(extra_in_df))
 
     for col in required_features:
         if col in df.columns:
@@ -296,6 +503,7 @@ def prepare_data(df: pd.DataFrame, education_level: str, features_mag, features_
 
     df = df[required_features]
 
-    logger.info(f"Подготовленные признаки: {list(df.columns)}")
+    log_event(logger, "Признаки подготовлены", logging.DEBUG, education_level=education_level,
+              rows=len(df), features=len(df.columns))
 
     return df
\ No newline at end of file
@@ -0,0 +1,196 @@
+import math
+
+import numpy as np
+
+from csv_func import (DEBT_GRADES, HDI_DICT, IS_NA, MAIN_COUNTRIES, POST_SOVIET, parse_score,
+                      power_penalty_scores, rank_arrays)
+from log_config import get_logger, log_sampled
+
+logger = get_logger(__name__)
+
+# Признаки одиночной формы без DataFrame: схема уровня собирается один раз на
+# снимок артефактов, поля формы раскладываются прямо в строку массива в порядке
+# признаков модели. Значения совпадают с collect_form_data + prepare_data.
+
+# (поле формы, значение по умолчанию, признак)
+NUMERIC_FIELDS = [
+    ('priority', 1, 'Приоритет'),
+    ('exam_score', 0, 'Cумма баллов испытаний'),
+    ('achievement', 0, 'Балл за инд. достижения'),
+    ('contract', 0, 'Контракт'),
+    ('dormitory', 0, 'Нуждается в общежитии'),
+    ('foreign', 0, 'Иностранный абитуриент (МОН)'),
+    ('gender', 0, 'Пол'),
+    ('age', 15, 'Полных лет на момент поступления'),
+    ('city', 0, 'fromEkaterinburg'),
+    ('region', 0, 'fromSverdlovskRegion'),
+]
+BAK_SPEC_NUMERIC_FIELDS = [('bvi', 0, 'БВИ')]
+
+
+def one_hot(*values) -> dict:
+    return {value: {value: 1} for value in values}
+
+
+# (поле формы, значение по умолчанию, {значение: {признак: значение}}, признаки для прочих значений)
+CHOICE_FIELDS = [
+    ('competition', 'Основные места', one_hot('Особая квота', 'Отдельная квота', 'Целевая квота'), {}),
+    ('form', 'Очная', one_hot('Заочная', 'Очно-заочная'), {}),
+    ('benefit', 'Нет', one_hot('Боевые действия', 'Инвалиды', 'Квота для иностранных граждан', 'Сироты'), {}),
+]
+BAK_SPEC_CHOICE_FIELDS = [
+    ('level', 'Бакалавр', {'Бакалавр': {}}, {'Специалист': 1}),
+    ('Тип олимпиады', 'Не писал', one_hot('всероссийская олимпиада школьников (ВОШ)',
+                                          'олимпиада из перечня, утвержденного МОН РФ (ОШ)'), {}),
+    ('Тип законченного учреждения', 'Школа', one_hot('Военное уч. заведение', 'Высшее', 'Профильная Школа', 'СПО'), {}),
+]
+MAGISTR_CONSTANTS = {'Высшее': 1}
+DIRECTION_PREFIXES = {code: {f'Код направления 1: {code}': 1} for code in ('10', '11', '27', '29')}
+DIRECTION_SUFFIXES = {f'0{code}': {f'Код направления 3: {code}': 1} for code in ('2', '3', '4')}
+
+
+def country_entry(country) -> dict:
+    return {
+        'PostSoviet': 1 if country in POST_SOVIET else 0,
+        'others': 1 if country not in MAIN_COUNTRIES else 0,
+        'Human Development Index': HDI_DICT.get(country, 0.0),
+    }
+
+
+class FormSchema:
+    def __init__(self, education_level: str, features, rank_arrays=None):
+        self.education_level = education_level
+        self.features = list(features)
+        self.index = {name: i for i, name in enumerate(self.features)}
+        self.template = np.zeros(len(self.features), dtype=np.float64)
+        if rank_arrays is not None:
+            self.rank_tables, self.rank_index = rank_arrays
+
+        bak_spec = education_level == 'bak_spec'
+        self.numeric = [(key, default, self.column(name))
+                        for key, default, name in NUMERIC_FIELDS + (BAK_SPEC_NUMERIC_FIELDS if bak_spec else [])]
+        self.choices = [(key, default, self.entries(table), self.compile(other))
+                        for key, default, table, other in CHOICE_FIELDS + (BAK_SPEC_CHOICE_FIELDS if bak_spec else [])]
+        self.constants = self.compile({} if bak_spec else MAGISTR_CONSTANTS)
+
+        countries = set(POST_SOVIET) | set(MAIN_COUNTRIES) | set(HDI_DICT)
+        self.countries = {country: self.compile(country_entry(country)) for country in countries}
+        self.other_country = self.compile(country_entry(None))
+        self.prefixes = self.entries(DIRECTION_PREFIXES)
+        self.suffixes = self.entries(DIRECTION_SUFFIXES)
+
+        self.rank_column = self.column('Позиция студента в рейтинге')
+        self.retakes_column = self.column('Общее количество пересдач')
+        self.debts_column = self.column('Общее количество долгов')
+
+    def column(self, name: str) -> int:
+        # Признаки, которых нет у модели, пропускаются (prepare_data их отбрасывает).
+        return self.index.get(name, -1)
+
+    def compile(self, values: dict) -> list:
+        return [(self.index[name], value) for name, value in values.items() if name in self.index]
+
+    def entries(self, table: dict) -> dict:
+        return {key: self.compile(values) for key, values in table.items()}
+
+    def row(self, form) -> np.ndarray:
+        row = self.template.copy()
+
+        for key, default, column in self.numeric:
+            value = int(form.get(key, default))
+            if column >= 0:
+                row[column] = value
+        for key, default, table, other in self.choices:
+            for column, value in table.get(form.get(key, default), other):
+                row[column] = value
+        for column, value in self.constants:
+            row[column] = value
+
+        country = form.get('country', 'Российская Федерация')
+        for column, value in self.countries.get(country, self.other_country):
+            row[column] = value
+
+        direction = form.get('direction', '00.00.00')
+        for column, value in self.prefixes.get(direction[:2], ()):
+            row[column] = value
+        for column, value in self.suffixes.get(direction[-2:], ()):
+            row[column] = value
+
+        prefix = 'b_' if self.education_level == 'bak_spec' else 'm_'
+        names = form.getlist(f'{prefix}subject_name[]')
+        grades = form.getlist(f'{prefix}subject_grade[]')
+        scores = form.getlist(f'{prefix}subject_score[]')
+        retakes = form.getlist(f'{prefix}subject_retakes[]')
+
+        total_retakes = 0
+        total_debts = 0
+        for i in range(len(names)):
+            grade = grades[i] if i < len(grades) else ''
+            total_retakes += int(retakes[i]) if i < len(retakes) else 0
+            if grade in DEBT_GRADES:
+                total_debts += 1
+
+        try:
+            rank = self.rank(names, grades, scores)
+        except Exception as e:
+            logger.error(f"Ошибка при вычислении ранга: {e}")
+            rank = 1
+
+        if self.rank_column >= 0:
+            row[self.rank_column] = rank
+        if self.retakes_column >= 0:
+            row[self.retakes_column] = total_retakes
+        if self.debts_column >= 0:
+            row[self.debts_column] = total_debts
+
+        log_sampled(logger, "Признаки из формы собраны", education_level=self.education_level,
+                    subjects=len(names), rank=rank)
+        return row.reshape(1, -1)
+
+    def rank(self, names, grades, scores) -> int:
+        # Штраф считается той же power_penalty_scores, что и для CSV: дисциплины
+        # в том же порядке, поэтому ранг совпадает до бита.
+        if not names:
+            return 1
+        student_scores = self.subject_scores(names, grades, scores)
+        codes = np.array(list(student_scores), dtype=np.int64)
+        values = np.array(list(student_scores.values()), dtype=np.float64)
+        penalty = power_penalty_scores(np.zeros(len(codes), dtype=np.int64), codes, values, self.rank_tables, 1)
+        return self.rank_index.rank(float(penalty[0]))
+
+    def shifted_ranks(self, names, grades, scores, shifts) -> np.ndarray:
+        # Ранги при сдвиге всех баллов дисциплин на shifts (сдвинутый балл не
+        # выходит за 0..100): каждый вариант — отдельный «студент» для
+        # power_penalty_scores, дисциплины в том же порядке, что в rank.
+        shifts = np.asarray(shifts, dtype=np.float64)
+        if not names:
+            return np.ones(len(shifts), dtype=np.int64)
+        student_scores = self.subject_scores(names, grades, scores)
+        codes = np.array(list(student_scores), dtype=np.int64)
+        values = np.array(list(student_scores.values()), dtype=np.float64)
+
+        shifted = np.clip(values + shifts[:, None], np.minimum(values, 0.0), np.maximum(values, 100.0))
+        penalties = power_penalty_scores(np.repeat(np.arange(len(shifts)), len(codes)),
+                                         np.tile(codes, len(shifts)), shifted.ravel(),
+                                         self.rank_tables, len(shifts))
+        return self.rank_index.ranks(penalties)
+
+    def subject_scores(self, names, grades, scores) -> dict:
+        index = self.rank_tables[0]
+        student_scores = {}
+        for i, name in enumerate(names):
+            code = index.get(name)
+            if code is None:
+                continue
+            score = parse_score(scores[i]) if i < len(scores) else None
+            if score is None or math.isnan(score):
+                score = IS_NA.get(grades[i] if i < len(grades) else '', 0)
+            student_scores[code] = float(score)
+        return student_scores
+
+
+def form_schema(artifacts, education_level: str) -> FormSchema:
+    # Массивы рангов берутся до build: derived не допускает вложенных вызовов.
+    arrays = rank_arrays(artifacts, education_level)
+    return artifacts.derived(('form_schema', education_level),
+                             lambda: FormSchema(education_level, artifacts.model(education_level)[2], arrays))
@@ -0,0 +1,40 @@
+import gc
+import os
+import shutil
+import tempfile
+
+# Приложение (модели, данные рангов) загружается в мастере до fork: рабочие
+# процессы получают его страницы памяти общими, без повторной загрузки.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# /metrics суммирует время этапов всех рабочих процессов и процессов пула
+# через общий каталог (metrics.py). Каталог задаётся до загрузки приложения,
+# рабочие процессы наследуют переменную окружения.
+own_metrics_dir = not os.environ.get('METRICS_DIR')
+if own_metrics_dir:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+
+
+def on_starting(server):
+    # Счётчики прошлого запуска не смешиваются с новыми.
+    from metrics import clear_metrics_dir
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+    clear_metrics_dir(os.environ['METRICS_DIR'])
+
+
+def on_exit(server):
+    if own_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def when_ready(server):
+    # Объекты, созданные при загрузке, переносятся в постоянное поколение:
+    # сборщик мусора в рабочих процессах не трогает их заголовки и не
+    # расщепляет общие страницы копированием при записи.
+    if preload_app:
+        # Фоновая загрузка моделей не переживает fork, поэтому в мастере
+        # она завершается синхронно до запуска рабочих процессов.
+        from app import load_prediction
+        load_prediction()
+        gc.freeze()
+        server.log.info(f"Приложение предзагружено, заморожено объектов: {gc.get_freeze_count()}")
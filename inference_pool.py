@@ -0,0 +1,59 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from app_func import predict_positive
+from artifacts import get_artifacts
+from log_config import get_logger
+from procutil import model_executor
+
+logger = get_logger(__name__)
+
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+INFERENCE_TIMEOUT_S = float(os.environ.get('INFERENCE_TIMEOUT_S', 30))
+MAX_PENDING_REQUESTS = int(os.environ.get('MAX_PENDING_REQUESTS', 64))
+QUEUE_TIMEOUT_S = float(os.environ.get('QUEUE_TIMEOUT_S', 1))
+
+
+def worker_pid(_=None) -> int:
+    return os.getpid()
+
+
+def predict_rows(education_level: str, X: np.ndarray) -> np.ndarray:
+    model, _, features = get_artifacts().model(education_level)
+    return predict_positive(model, X, features)
+
+
+class InferencePool:
+    def __init__(self, workers: int = INFERENCE_WORKERS):
+        self.workers = workers
+        self.executor = None
+
+    def start(self):
+        if self.workers <= 0:
+            logger.info("Инференс выполняется в пуле потоков процесса сервера")
+            return
+
+        self.executor = model_executor(self.workers)
+        pids = set(self.executor.map(worker_pid, range(self.workers * 4)))
+        logger.info(f"Запущен пул инференса: {self.workers} процессов {sorted(pids)}")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def predict(self, education_level: str, X: np.ndarray) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, predict_rows, education_level, X)
+        except BrokenProcessPool:
+            logger.error("Пул инференса упал, перезапускаем")
+            self.shutdown()
+            self.start()
+            raise
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "mode": "process" if self.executor is not None else "thread"}
@@ -0,0 +1,260 @@
+import codecs
+import os
+import pickle
+import shutil
+import tempfile
+
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+ENCODINGS = ['utf-8', 'cp1251', 'latin1', 'iso-8859-1']
+CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 50000))
+STREAM_THRESHOLD_BYTES = int(os.environ.get('CSV_STREAM_THRESHOLD_BYTES', 10 * 1024 * 1024))
+READ_BLOCK_BYTES = 1024 * 1024
+SAMPLE_BYTES = 64 * 1024
+SPOOL_MAX_BYTES = int(os.environ.get('UPLOAD_SPOOL_MAX_BYTES', 1024 * 1024))
+# Внешняя сортировка больших файлов: отсортированные чанки лежат во временных
+# файлах (каталог по умолчанию — TMPDIR) блоками по SPILL_BLOCK_ROWS строк.
+SPILL_DIR = os.environ.get('CSV_SPILL_DIR') or None
+SPILL_BLOCK_ROWS = int(os.environ.get('CSV_SPILL_BLOCK_ROWS', 5000))
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def stream_size(stream) -> int:
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def spool_file(max_size: int = SPOOL_MAX_BYTES):
+    return tempfile.SpooledTemporaryFile(max_size=max_size, mode='w+b')
+
+
+def spool_upload(stream, max_size: int = SPOOL_MAX_BYTES):
+    try:
+        stream.seek(0)
+        return stream
+    except (AttributeError, OSError):
+        pass
+    spooled = spool_file(max_size)
+    shutil.copyfileobj(stream, spooled, READ_BLOCK_BYTES)
+    spooled.seek(0)
+    return spooled
+
+
+def sniff_encoding(stream, sample_bytes: int = SAMPLE_BYTES) -> str:
+    stream.seek(0)
+    sample = stream.read(sample_bytes)
+    stream.seek(0)
+
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    # Образец может оборвать многобайтовый символ, поэтому последний
+    # неполный символ прощается, если файл длиннее образца.
+    final = len(sample) < sample_bytes
+    for encoding in ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+
+    raise ValueError("Не удалось прочитать файл. Проверьте кодировку")
+
+
+def candidate_encodings(stream) -> list:
+    detected = sniff_encoding(stream)
+    if detected in ('utf-8-sig', 'utf-16'):
+        return [detected]
+    return [detected] + [encoding for encoding in ENCODINGS if encoding != detected]
+
+
+def open_with_fallback(stream, read):
+    # read(stream, encoding) разбирает файл (или его начало) в одной кодировке;
+    # при UnicodeDecodeError файл перечитывается в следующей. Возвращает
+    # (кодировка, результат read).
+    for encoding in candidate_encodings(stream):
+        stream.seek(0)
+        try:
+            return encoding, read(stream, encoding)
+        except UnicodeDecodeError:
+            logger.warning("Файл не читается в кодировке %s, пробуем следующую", encoding)
+
+    raise ValueError("Не удалось прочитать файл. Проверьте кодировку")
+
+
+def read_upload(stream):
+    import pandas as pd
+
+    return open_with_fallback(stream, lambda f, encoding: pd.read_csv(f, sep=';', encoding=encoding))[1]
+
+
+def read_example(education_level: str):
+    import io
+
+    import pandas as pd
+
+    with open(f'static/examples/example_{education_level}.csv', 'rb') as f:
+        df = read_upload(f)
+
+    # В примерах после данных идут пояснения к столбцам, отбрасываем их
+    # и перечитываем, чтобы типы столбцов вывелись по самим данным.
+    df = df[pd.to_numeric(df['id_студента'], errors='coerce').notna()]
+    return pd.read_csv(io.StringIO(df.to_csv(sep=';', index=False)), sep=';')
+
+
+def iter_student_chunks(stream, encoding: str, chunk_rows: int = CHUNK_ROWS, key: str = 'id_студента',
+                        progress=None):
+    # Строки файла могут идти в любом порядке. Внешняя сортировка: каждый чанк
+    # сортируется по id_студента и сбрасывается во временный файл, затем
+    # прогоны сливаются в чанки из целых студентов по возрастанию id — порядок
+    # и нумерация как при обработке файла целиком. Файл читается сразу при
+    # вызове, поэтому ошибки разбора видны до первого результата.
+    # progress(доля) — доля строк, отданных в чанках.
+    runs, total, numeric = spill_sorted_runs(stream, encoding, chunk_rows, key)
+    if len(set(numeric)) > 1:
+        # В одних чанках id числовые, в других строковые: при чтении целиком
+        # столбец был бы строковым, поэтому файл перечитывается так же.
+        close_runs(runs)
+        stream.seek(0)
+        runs, total, _ = spill_sorted_runs(stream, encoding, chunk_rows, key, dtype={key: str})
+    return merge_runs(runs, key, chunk_rows, total, progress)
+
+
+def frame_student_chunks(df, chunk_rows: int = CHUNK_ROWS, key: str = 'id_студента', progress=None):
+    # Файл, уже прочитанный целиком: те же чанки, что у iter_student_chunks.
+    if key not in df.columns:
+        raise ValueError(f"В файле нет столбца {key}")
+    df = df[df[key].notna()].sort_values(key, kind='stable', ignore_index=True)
+    return split_students(df, key, chunk_rows, progress)
+
+
+def split_students(df, key: str, chunk_rows: int, progress=None):
+    ids = df[key]
+    start = 0
+    while start < len(df):
+        end = int(ids.searchsorted(ids.iloc[min(start + chunk_rows, len(df)) - 1], side='right'))
+        if progress is not None:
+            progress(end / len(df))
+        yield df.iloc[start:end]
+        start = end
+
+
+def spill_sorted_runs(stream, encoding: str, chunk_rows: int, key: str, dtype=None):
+    import pandas as pd
+
+    runs, numeric = [], []
+    total = 0
+    try:
+        for chunk in pd.read_csv(stream, sep=';', encoding=encoding, chunksize=chunk_rows, dtype=dtype):
+            if key not in chunk.columns:
+                raise ValueError(f"В файле нет столбца {key}")
+            # Строки без id_студента при обработке всё равно отбрасываются.
+            chunk = chunk[chunk[key].notna()]
+            if chunk.empty:
+                continue
+            numeric.append(pd.api.types.is_numeric_dtype(chunk[key]))
+            chunk = chunk.sort_values(key, kind='stable')
+
+            run = tempfile.TemporaryFile(dir=SPILL_DIR)
+            runs.append(run)
+            for start in range(0, len(chunk), SPILL_BLOCK_ROWS):
+                pickle.dump(chunk.iloc[start:start + SPILL_BLOCK_ROWS], run, protocol=pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+            total += len(chunk)
+    except BaseException:
+        close_runs(runs)
+        raise
+    return runs, total, numeric
+
+
+def merge_runs(runs: list, key: str, chunk_rows: int = CHUNK_ROWS, total: int = 0, progress=None):
+    import pandas as pd
+
+    # Слияние шагами: граница — наименьший из id-кандидатов голов прогонов
+    # (id около позиции step в голове), все строки с id меньше границы уже
+    # прочитаны из каждого прогона, а шаг даёт около chunk_rows строк. Части
+    # склеиваются в порядке прогонов и сортируются устойчиво, поэтому строки
+    # студента остаются в порядке файла.
+    step = max(1, chunk_rows // max(len(runs), 1))
+    blocks = [run_blocks(run) for run in runs]
+    heads = [None] * len(runs)
+    done = [False] * len(runs)
+    pending, pending_rows, merged = [], 0, 0
+    try:
+        while True:
+            for i in range(len(runs)):
+                if not done[i]:
+                    heads[i], done[i] = fill_head(heads[i], blocks[i], key)
+            live = [i for i in range(len(runs)) if not done[i]]
+
+            parts = []
+            if live:
+                bound = min(step_bound(heads[i][key], step) for i in live)
+                for i, head in enumerate(heads):
+                    cut = head[key].searchsorted(bound, side='left') if head is not None else 0
+                    if cut:
+                        parts.append(head.iloc[:cut])
+                        heads[i] = head.iloc[cut:]
+            else:
+                parts = [head for head in heads if head is not None and len(head)]
+
+            if parts:
+                piece = pd.concat(parts).sort_values(key, kind='stable') if len(parts) > 1 else parts[0]
+                pending.append(piece)
+                pending_rows += len(piece)
+            if pending and (pending_rows >= chunk_rows or not live):
+                merged += pending_rows
+                if progress is not None and total:
+                    progress(merged / total)
+                chunk = pd.concat(pending, ignore_index=True)
+                pending, pending_rows = [], 0
+                yield chunk
+            if not live:
+                return
+    finally:
+        close_runs(runs)
+
+
+def step_bound(ids, step: int):
+    # Id на позиции step (не дальше конца головы); если до него идёт один
+    # студент — следующий id, чтобы граница продвинулась хотя бы на студента.
+    bound = ids.iloc[min(step, len(ids)) - 1]
+    if bound == ids.iloc[0]:
+        bound = ids.iloc[ids.searchsorted(bound, side='right')]
+    return bound
+
+
+def fill_head(head, blocks, key: str):
+    # Голова прогона дочитывается, пока в ней не окажется больше одного id
+    # (иначе граница слияния может не сдвинуться). Возвращает (голова, прогон исчерпан).
+    import pandas as pd
+
+    while head is None or head.empty or head[key].iloc[0] == head[key].iloc[-1]:
+        block = next(blocks, None)
+        if block is None:
+            return head, True
+        head = block if head is None or head.empty else pd.concat([head, block])
+    return head, False
+
+
+def run_blocks(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def close_runs(runs: list):
+    for run in runs:
+        run.close()
@@ -0,0 +1,256 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import READ_BLOCK_BYTES, STREAM_THRESHOLD_BYTES
+from log_config import get_logger, log_event
+
+logger = get_logger(__name__)
+
+# Фоновые задания на обработку файлов: загрузка сразу получает номер, файл
+# обрабатывается пулом потоков, результат лежит в каталоге задания до истечения срока.
+# Каталог задания: input.csv, meta.json (статус, прогресс), result.csv.
+JOBS_DIR = os.environ.get('JOBS_DIR', 'jobs')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_TTL_S = float(os.environ.get('JOB_TTL_S', 24 * 3600))
+JOB_CLEANUP_INTERVAL_S = float(os.environ.get('JOB_CLEANUP_INTERVAL_S', 600))
+# Файлы от этого размера из формы на /predict тоже уходят в задание, а не
+# обрабатываются внутри запроса (таймаут рабочего процесса gunicorn).
+JOB_THRESHOLD_BYTES = int(os.environ.get('JOB_THRESHOLD_BYTES', STREAM_THRESHOLD_BYTES))
+PROGRESS_INTERVAL_S = 0.5
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+
+def valid_job_id(job_id: str) -> bool:
+    return len(job_id) == 32 and all(c in '0123456789abcdef' for c in job_id)
+
+
+def pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    def __init__(self, root: str = JOBS_DIR, ttl_s: float = JOB_TTL_S):
+        self.root = root
+        self.ttl = ttl_s
+        self._lock = threading.Lock()
+
+    def path(self, job_id: str, name: str = '') -> str:
+        if not valid_job_id(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.root, job_id, name)
+
+    def create(self, upload, education_level: str, filename: str = '') -> dict:
+        # Каталог собирается под временным именем и переименовывается целиком:
+        # другие процессы не видят задание без входного файла.
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.root, exist_ok=True)
+        staging = os.path.join(self.root, f'.{job_id}.tmp')
+        os.makedirs(staging)
+        try:
+            upload.seek(0)
+            with open(os.path.join(staging, 'input.csv'), 'wb') as f:
+                shutil.copyfileobj(upload, f, READ_BLOCK_BYTES)
+            now = time.time()
+            meta = {
+                'id': job_id,
+                'status': QUEUED,
+                'education_level': education_level,
+                'filename': filename,
+                'input_bytes': os.path.getsize(os.path.join(staging, 'input.csv')),
+                'created_at': now,
+                'updated_at': now,
+                'started_at': None,
+                'finished_at': None,
+                'progress': 0.0,
+                'students': 0,
+                'error': None,
+                'pid': None,
+            }
+            self._write_meta(staging, meta)
+            os.rename(staging, os.path.join(self.root, job_id))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return meta
+
+    def get(self, job_id: str):
+        try:
+            with open(self.path(job_id, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (KeyError, FileNotFoundError, json.JSONDecodeError):
+            return None
+        if self.expired(meta):
+            return None
+        return meta
+
+    def update(self, job_id: str, **fields) -> dict:
+        # meta.json пишет только процесс, выполняющий задание; замена файла
+        # атомарна, поэтому читатели из других процессов видят целую версию.
+        with self._lock:
+            with open(self.path(job_id, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            meta.update(fields, updated_at=time.time())
+            self._write_meta(self.path(job_id), meta)
+        return meta
+
+    def _write_meta(self, directory: str, meta: dict):
+        tmp = os.path.join(directory, f'meta.json.{os.getpid()}.{threading.get_ident()}')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+    def claim(self, job_id: str) -> bool:
+        # Задание забирает ровно один процесс: файл-метка создаётся с O_EXCL.
+        # Метка зависшего процесса (процесс умер) снимается при очистке.
+        try:
+            fd = os.open(self.path(job_id, 'claim'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except (FileExistsError, FileNotFoundError):
+            return False
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+
+    def claim_owner(self, job_id: str):
+        try:
+            with open(self.path(job_id, 'claim')) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def expired(self, meta: dict, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        return meta['status'] in FINISHED and meta['updated_at'] + self.ttl < now
+
+    def delete(self, job_id: str):
+        shutil.rmtree(self.path(job_id), ignore_errors=True)
+
+    def job_ids(self) -> list:
+        try:
+            return [name for name in os.listdir(self.root) if valid_job_id(name)]
+        except FileNotFoundError:
+            return []
+
+    def cleanup(self, now: float = None) -> dict:
+        now = time.time() if now is None else now
+        removed, orphaned = 0, []
+        for job_id in self.job_ids():
+            try:
+                with open(self.path(job_id, 'meta.json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if self.expired(meta, now):
+                self.delete(job_id)
+                removed += 1
+            elif meta['status'] not in FINISHED and not pid_alive(self.claim_owner(job_id)):
+                # Процесс, взявший задание, завершился (перезапуск, таймаут
+                # gunicorn): задание снова становится свободным.
+                try:
+                    os.remove(self.path(job_id, 'claim'))
+                except FileNotFoundError:
+                    pass
+                orphaned.append(job_id)
+
+        # Недособранные каталоги от упавших загрузок.
+        try:
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.endswith('.tmp') and os.path.getmtime(path) + self.ttl < now:
+                    shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+        return {'removed': removed, 'orphaned': orphaned}
+
+
+class JobRunner:
+    def __init__(self, store: JobStore, process, workers: int = JOB_WORKERS,
+                 cleanup_interval_s: float = JOB_CLEANUP_INTERVAL_S):
+        # process(input_path, output, education_level, progress) -> число студентов
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.cleanup_interval = cleanup_interval_s
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Пул создаётся лениво в процессе, который обслуживает запросы:
+        # потоки не переживают fork мастера gunicorn.
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=max(self.workers, 1), thread_name_prefix='job')
+            self._pid = os.getpid()
+            threading.Thread(target=self._cleanup_loop, name='job-cleanup', daemon=True).start()
+
+    def submit(self, job_id: str):
+        self.start()
+        self._executor.submit(self.run, job_id)
+
+    def run(self, job_id: str):
+        if not self.store.claim(job_id):
+            return
+        meta = self.store.get(job_id)
+        if meta is None or meta['status'] in FINISHED:
+            return
+        meta = self.store.update(job_id, status=RUNNING, pid=os.getpid(), started_at=time.time(),
+                                 progress=0.0, error=None)
+        level = meta['education_level']
+        log_event(logger, "Задание запущено", job_id=job_id, education_level=level,
+                  input_bytes=meta['input_bytes'])
+
+        last = [0.0]
+
+        def progress(fraction: float, students: int):
+            now = time.monotonic()
+            if now - last[0] >= PROGRESS_INTERVAL_S:
+                last[0] = now
+                self.store.update(job_id, progress=round(min(fraction, 1.0), 4), students=students)
+
+        started = time.perf_counter()
+        partial = self.store.path(job_id, 'result.csv.part')
+        try:
+            with open(partial, 'w+b') as output:
+                students = self.process(self.store.path(job_id, 'input.csv'), output, level, progress)
+            os.replace(partial, self.store.path(job_id, 'result.csv'))
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задания {job_id}: {e}", exc_info=True)
+            self.store.update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            return
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        self.store.update(job_id, status=DONE, progress=1.0, students=students, finished_at=time.time())
+        log_event(logger, "Задание выполнено", job_id=job_id, education_level=level, students=students,
+                  duration_s=round(time.perf_counter() - started, 3))
+
+    def _cleanup_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                result = self.store.cleanup()
+                for job_id in result['orphaned']:
+                    log_event(logger, "Задание без исполнителя поставлено в очередь", job_id=job_id)
+                    self.submit(job_id)
+                if result['removed']:
+                    log_event(logger, "Удалены просроченные задания", removed=result['removed'])
+            except Exception as e:
+                logger.error(f"Ошибка очистки заданий: {e}")
+            time.sleep(self.cleanup_interval)
@@ -0,0 +1,116 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+# Общая настройка логов для app.py, model_server.py и модулей обработки.
+# Запись в лог из обработчика запроса — только постановка записи в очередь:
+# форматирование и вывод выполняет отдельный поток.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Если поток вывода не успевает, записи отбрасываются, а не блокируют запрос.
+    dropped = 0
+
+    def prepare(self, record):
+        # Очередь внутри процесса: запись передаётся как есть, сообщение
+        # форматируется уже в потоке вывода. Аргументы должны быть неизменяемыми.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, 'fields', None)
+        if LOG_FORMAT == 'json':
+            payload = {
+                'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+            }
+            if fields:
+                payload.update(fields)
+            if record.exc_info:
+                payload['exc_info'] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+
+        message = super().format(record)
+        if fields:
+            message += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return message
+
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(TEXT_FORMAT))
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=False)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _after_fork():
+    # Поток вывода не переживает fork (gunicorn --preload, пул инференса):
+    # в дочернем процессе создаются новые очередь и поток.
+    if _handler is not None:
+        _start_listener()
+
+
+def setup_logging():
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL)
+        _start_listener()
+        atexit.register(_stop_listener)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields):
+    # Структурированная сводка вместо дампа данных: событие и скалярные поля.
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+def log_sampled(logger: logging.Logger, event: str, level: int = logging.DEBUG,
+                rate: float = LOG_SAMPLE_RATE, **fields):
+    # Для событий на каждую строку/студента: пишется лишь доля rate.
+    if logger.isEnabledFor(level) and random.random() < rate:
+        logger.log(level, event, extra={'fields': {**fields, 'sample_rate': rate}})
@@ -0,0 +1,93 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Сравнение памяти рабочих процессов gunicorn: каждый процесс грузит модели сам
+# против предзагрузки в мастере с отображением массивов моделей в память.
+# Использование: python memory_report.py [число_процессов] [порт]
+MODES = [
+    ('без предзагрузки', {'GUNICORN_PRELOAD': '0', 'MODEL_MMAP': '0'}),
+    ('предзагрузка + mmap', {'GUNICORN_PRELOAD': '1', 'MODEL_MMAP': '1'}),
+]
+FIELDS = ['Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty']
+
+
+def smaps_rollup(pid: int) -> dict:
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                values[name] = int(rest.split()[0])
+    return values
+
+
+def children(pid: int) -> list:
+    result = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            result.append(int(entry))
+    return sorted(result)
+
+
+def wait_ready(port: int, master: int, workers: int, timeout: float = 120) -> float:
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        # /ready отвечает 503, пока процесс не загрузил модели; ответы
+        # подряд от всех процессов означают, что загрузились все.
+        try:
+            for _ in range(workers * 4):
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1).read()
+            if len(children(master)) == workers:
+                return time.monotonic() - started
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn не запустился")
+
+
+def measure(title: str, env: dict, workers: int, port: int) -> dict:
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+         '-b', f'127.0.0.1:{port}', 'app:app'],
+        env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        startup = wait_ready(port, process.pid, workers)
+        time.sleep(1)
+
+        master = smaps_rollup(process.pid)
+        per_worker = [smaps_rollup(pid) for pid in children(process.pid)]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(30)
+
+    total = {field: master[field] + sum(w[field] for w in per_worker) for field in FIELDS}
+    print(f"\n{title}: {workers} процессов, готовность через {startup:.1f} с")
+    print(f"{'процесс':<10}" + ''.join(f"{field:>15}" for field in FIELDS))
+    print(f"{'master':<10}" + ''.join(f"{master[field]:>12} kB" for field in FIELDS))
+    for i, values in enumerate(per_worker):
+        print(f"{f'worker {i}':<10}" + ''.join(f"{values[field]:>12} kB" for field in FIELDS))
+    print(f"{'итого':<10}" + ''.join(f"{total[field]:>12} kB" for field in FIELDS))
+    return total
+
+
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    totals = [measure(title, env, workers, port) for title, env in MODES]
+
+    # Pss делит общие страницы между процессами: это реальный вклад в память машины.
+    before, after = totals[0]['Pss'], totals[1]['Pss']
+    print(f"\nСуммарный Pss: {before / 1024:.1f} МБ -> {after / 1024:.1f} МБ "
+          f"({(before - after) / max(before, 1):.0%} экономии)")
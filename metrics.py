@@ -0,0 +1,268 @@
+import bisect
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+# Гистограммы длительности этапов обработки по уровням образования.
+# Запись — два вызова perf_counter и инкремент корзины; квантили и скорость
+# считаются только при чтении /metrics.
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+QUANTILES = (0.5, 0.95, 0.99)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Общий каталог метрик для нескольких процессов, как multiprocess-режим
+# prometheus_client: каждый процесс (рабочие gunicorn, процессы пула
+# parallel.py) пишет гистограммы в свой файл stages_<pid>.db через mmap, а
+# /metrics суммирует все файлы каталога. Файлы завершившихся процессов
+# остаются — их счётчики входят в сумму. Без каталога метрики хранятся в
+# памяти и видны только в своём процессе. gunicorn.conf.py задаёт каталог
+# и очищает его при запуске.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+
+
+class StageHistogram:
+    __slots__ = ('counts', 'total', 'count', 'rows')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.rows = 0
+
+    def quantile(self, q: float) -> float:
+        # Линейная интерполяция внутри корзины, как histogram_quantile в Prometheus.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return BUCKETS[-1]
+
+
+# Значения записи: корзины, сумма, количество, строки.
+VALUES = len(BUCKETS) + 4
+HEADER = struct.Struct('Q')
+KEY_SIZE = struct.Struct('I')
+DOUBLE = struct.Struct('d')
+INITIAL_FILE_SIZE = 1 << 16
+
+
+def read_records(data):
+    # Файл процесса: 8 байт — занятая длина, далее записи: длина ключа,
+    # ключ «этап\0уровень» в utf-8 с выравниванием до 8 байт и VALUES чисел.
+    used = HEADER.unpack_from(data, 0)[0]
+    offset = HEADER.size
+    while offset < used:
+        size = KEY_SIZE.unpack_from(data, offset)[0]
+        key = bytes(data[offset + KEY_SIZE.size:offset + KEY_SIZE.size + size]).decode('utf-8')
+        values = offset + (KEY_SIZE.size + size + 7) // 8 * 8
+        yield tuple(key.split('\0', 1)), values
+        offset = values + VALUES * 8
+
+
+class StageFile:
+    def __init__(self, path: str):
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(INITIAL_FILE_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._used = HEADER.unpack_from(self._map, 0)[0] or HEADER.size
+        self._positions = dict(read_records(self._map))
+
+    def observe(self, key: tuple, index: int, seconds: float, rows: int):
+        values = self._positions.get(key)
+        if values is None:
+            values = self._append(key)
+        self._add(values + index * 8, 1)
+        self._add(values + (len(BUCKETS) + 1) * 8, seconds)
+        self._add(values + (len(BUCKETS) + 2) * 8, 1)
+        self._add(values + (len(BUCKETS) + 3) * 8, rows)
+
+    def _add(self, position: int, delta: float):
+        DOUBLE.pack_into(self._map, position, DOUBLE.unpack_from(self._map, position)[0] + delta)
+
+    def _append(self, key: tuple) -> int:
+        encoded = '\0'.join(key).encode('utf-8')
+        values = self._used + (KEY_SIZE.size + len(encoded) + 7) // 8 * 8
+        end = values + VALUES * 8
+        if end > len(self._map):
+            size = len(self._map)
+            while size < end:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        KEY_SIZE.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + KEY_SIZE.size:self._used + KEY_SIZE.size + len(encoded)] = encoded
+        # Длина обновляется последней: читатель не увидит запись без значений.
+        HEADER.pack_into(self._map, 0, end)
+        self._used = end
+        self._positions[key] = values
+        return values
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def read_stage_files(directory: str) -> dict:
+    snapshot = {}
+    for path in glob.glob(os.path.join(directory, 'stages_*.db')):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        if len(data) < HEADER.size:
+            continue
+        for key, values in read_records(data):
+            numbers = struct.unpack_from(f'{VALUES}d', data, values)
+            histogram = snapshot.get(key)
+            if histogram is None:
+                histogram = snapshot[key] = StageHistogram()
+            for i in range(len(BUCKETS) + 1):
+                histogram.counts[i] += int(numbers[i])
+            histogram.total += numbers[-3]
+            histogram.count += int(numbers[-2])
+            histogram.rows += int(numbers[-1])
+    return snapshot
+
+
+def clear_metrics_dir(directory: str = METRICS_DIR):
+    for path in glob.glob(os.path.join(directory, 'stages_*.db')):
+        os.remove(path)
+
+
+class StageMetrics:
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self._stages = {}
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, education_level: str, seconds: float, rows: int = 0):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            if self.directory is not None:
+                # После fork (процессы пула, рабочие gunicorn) — свой файл.
+                if self._pid != os.getpid():
+                    self._file = StageFile(os.path.join(self.directory, f'stages_{os.getpid()}.db'))
+                    self._pid = os.getpid()
+                self._file.observe((stage, education_level), index, seconds, rows)
+                return
+            histogram = self._stages.get((stage, education_level))
+            if histogram is None:
+                histogram = self._stages[(stage, education_level)] = StageHistogram()
+            histogram.counts[index] += 1
+            histogram.total += seconds
+            histogram.count += 1
+            histogram.rows += rows
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            if self._pid == os.getpid():
+                self._file.close()
+                os.remove(os.path.join(self.directory, f'stages_{self._pid}.db'))
+            self._file = self._pid = None
+
+    def snapshot(self) -> dict:
+        if self.directory is not None:
+            return read_stage_files(self.directory)
+        with self._lock:
+            snapshot = {}
+            for key, histogram in self._stages.items():
+                copy = StageHistogram()
+                copy.counts = list(histogram.counts)
+                copy.total, copy.count, copy.rows = histogram.total, histogram.count, histogram.rows
+                snapshot[key] = copy
+        return snapshot
+
+    def render(self) -> str:
+        snapshot = dict(sorted(self.snapshot().items()))
+
+        lines = [
+            '# HELP stage_duration_seconds Длительность этапа обработки',
+            '# TYPE stage_duration_seconds histogram',
+        ]
+        for (stage, level), histogram in snapshot.items():
+            labels = f'stage="{stage}",education_level="{level}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram.counts):
+                cumulative += n
+                lines.append(f'stage_duration_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'stage_duration_seconds_sum{{{labels}}} {histogram.total:.6f}')
+            lines.append(f'stage_duration_seconds_count{{{labels}}} {histogram.count}')
+
+        lines += [
+            '# HELP stage_duration_quantile_seconds Квантили длительности этапа по гистограмме',
+            '# TYPE stage_duration_quantile_seconds gauge',
+        ]
+        for (stage, level), histogram in snapshot.items():
+            for q in QUANTILES:
+                lines.append(f'stage_duration_quantile_seconds{{stage="{stage}",education_level="{level}",'
+                             f'quantile="{q:g}"}} {histogram.quantile(q):.6f}')
+
+        lines += [
+            '# HELP stage_rows_total Строк обработано этапом',
+            '# TYPE stage_rows_total counter',
+        ]
+        for (stage, level), histogram in snapshot.items():
+            lines.append(f'stage_rows_total{{stage="{stage}",education_level="{level}"}} {histogram.rows}')
+
+        lines += [
+            '# HELP stage_rows_per_second Средняя скорость этапа, строк в секунду',
+            '# TYPE stage_rows_per_second gauge',
+        ]
+        for (stage, level), histogram in snapshot.items():
+            rate = histogram.rows / histogram.total if histogram.total else 0.0
+            lines.append(f'stage_rows_per_second{{stage="{stage}",education_level="{level}"}} {rate:.3f}')
+
+        return '\n'.join(lines) + '\n'
+
+
+stage_metrics = StageMetrics()
+
+
+class StageTimer:
+    __slots__ = ('rows',)
+
+    def __init__(self, rows: int):
+        self.rows = rows
+
+
+@contextmanager
+def timed(stage: str, education_level: str, rows: int = 0):
+    # Время этапа пишется только при успешном завершении; число строк можно
+    # уточнить внутри блока через timer.rows.
+    timer = StageTimer(rows)
+    started = time.perf_counter()
+    yield timer
+    stage_metrics.observe(stage, education_level, time.perf_counter() - started, timer.rows)
+
+
+def timed_iter(stage: str, education_level: str, items):
+    # Для генераторов (чтение CSV по чанкам): замеряется получение каждого элемента.
+    items = iter(items)
+    while True:
+        started = time.perf_counter()
+        item = next(items, None)
+        if item is None:
+            return
+        stage_metrics.observe(stage, education_level, time.perf_counter() - started, len(item))
+        yield item
+
+
+def render_metrics() -> str:
+    return stage_metrics.render()
@@ -0,0 +1,147 @@
+import hashlib
+import http.client
+import io
+import os
+import socket
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+# Инференс на сервере моделей (model_server.py) вместо загрузки моделей в
+# процесс Flask: матрица признаков уходит в POST /predict/binary массивом .npy
+# по постоянным соединениям. MODEL_SERVER_URL — http://хост:порт или
+# unix:///путь/к/сокету (uvicorn model_server:app --uds ...); пусто — модели
+# считаются в процессе, как раньше.
+MODEL_SERVER_URL = os.environ.get('MODEL_SERVER_URL', '')
+MODEL_SERVER_TIMEOUT_S = float(os.environ.get('MODEL_SERVER_TIMEOUT_S', 30))
+MODEL_SERVER_POOL_SIZE = int(os.environ.get('MODEL_SERVER_POOL_SIZE', 8))
+# После ошибки соединения сервер не опрашивается столько секунд: запросы сразу
+# считаются в процессе, без ожидания таймаута на каждом.
+MODEL_SERVER_RETRY_S = float(os.environ.get('MODEL_SERVER_RETRY_S', 5))
+NPY_CONTENT_TYPE = 'application/x-npy'
+
+
+class ModelServerError(Exception):
+    pass
+
+
+def feature_fingerprint(feature_columns: list) -> str:
+    return hashlib.sha256('\n'.join(feature_columns).encode('utf-8')).hexdigest()[:16]
+
+
+def npy_bytes(X: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, np.ascontiguousarray(X), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def npy_array(data: bytes) -> np.ndarray:
+    return np.lib.format.read_array(io.BytesIO(data), allow_pickle=False)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ModelClient:
+    def __init__(self, url: str = MODEL_SERVER_URL, pool_size: int = MODEL_SERVER_POOL_SIZE,
+                 timeout_s: float = MODEL_SERVER_TIMEOUT_S, retry_s: float = MODEL_SERVER_RETRY_S):
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = timeout_s
+        self.retry = retry_s
+        parts = urlsplit(url)
+        if parts.scheme == 'unix':
+            self._connect = lambda: UnixHTTPConnection(parts.path, self.timeout)
+        elif parts.scheme == 'http':
+            self._connect = lambda: http.client.HTTPConnection(parts.hostname, parts.port or 80,
+                                                               timeout=self.timeout)
+        else:
+            raise ValueError(f"MODEL_SERVER_URL: ожидается http:// или unix://, получено {url}")
+        self._idle = []
+        self._pid = os.getpid()
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        # Соединения не переживают fork (мастер gunicorn, пулы процессов):
+        # в новом процессе пул начинается заново.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle, self._pid = [], os.getpid()
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _release(self, connection):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def predict(self, education_level: str, X: np.ndarray, features: list) -> np.ndarray:
+        if time.monotonic() < self._down_until:
+            raise ModelServerError("сервер моделей недавно был недоступен")
+
+        body = npy_bytes(np.asarray(X, dtype=np.float64))
+        headers = {
+            'Content-Type': NPY_CONTENT_TYPE,
+            'Accept': NPY_CONTENT_TYPE,
+            'X-Feature-Fingerprint': feature_fingerprint(features),
+        }
+        path = f'/predict/binary?education_level={quote(education_level)}'
+        while True:
+            connection, reused = self._acquire()
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                # Сервер закрыл простаивавшее соединение: повтор на новом.
+                if reused:
+                    continue
+                self._down_until = time.monotonic() + self.retry
+                raise ModelServerError(f"нет связи с {self.url}: {e}") from e
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        if response.status != 200:
+            raise ModelServerError(f"ответ {response.status}: {data[:200].decode('utf-8', 'replace')}")
+        predictions = npy_array(data)
+        if predictions.shape != (len(X),):
+            raise ModelServerError(f"ожидалось {len(X)} предсказаний, получено {predictions.shape}")
+        return predictions
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+client = ModelClient() if MODEL_SERVER_URL else None
+
+
+def local_only():
+    # Сам сервер моделей всегда считает в процессе, даже если переменная
+    # окружения общая с Flask.
+    global client
+    client = None
@@ -1,15 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import joblib
+import asyncio
+import functools
+import io
+import json
+from contextlib import asynccontextmanager
 import pandas as pd
 import numpy as np
 import logging
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+import model_client
+from artifacts import get_artifacts
+from batching import MicroBatcher
+from form_schema import form_schema
+from inference_pool import InferencePool, INFERENCE_TIMEOUT_S, MAX_PENDING_REQUESTS, QUEUE_TIMEOUT_S
+from log_config import get_logger, log_event
+from metrics import CONTENT_TYPE, render_metrics, timed
+from model_client import NPY_CONTENT_TYPE, feature_fingerprint, npy_bytes
+from prediction_cache import prediction_cache
+from what_if import parse_grid, profile_form, what_if_matrix, what_if_surface
 
-app = FastAPI()
+logger = get_logger(__name__)
+
+# Сервер сам считает модели, даже если MODEL_SERVER_URL задан и для него.
+model_client.local_only()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pool.start()
+    yield
+    pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,30 +47,159 @@ app.add_middleware(
 )
 
 try:
-    model_magistr = joblib.load('models/linear_model_nystroem_s_magistr_lof.joblib')
-    model_bak_spec = joblib.load('models/rf_model_s_bak_spec_mah.joblib')
+    get_artifacts()
     logger.info("Модели успешно загружены")
 except Exception as e:
     logger.error(f"Ошибка загрузки моделей: {str(e)}")
     raise
 
-FEATURE_COLUMNS = [
-    'Приоритет', 'Cумма баллов испытаний', 'БВИ', 'Балл за инд. достижения',
-       'Категория конкурса БВИ', 'Контракт', 'Нуждается в общежитии',
-       'Иностранный абитуриент (МОН)', 'Пол',
-       'Полных лет на момент поступления',
-       'Прошло лет с окончания уч. заведения', 'fromEkaterinburg',
-       'fromSverdlovskRegion', 'Human Development Index', 'Особая квота',
-       'Отдельная квота', 'Целевая квота',
-       'всероссийская олимпиада школьников (ВОШ)',
-       'олимпиада из перечня, утвержденного МОН РФ (ОШ)', 'Заочная',
-       'Очно-заочная', 'Специалист', 'Военное уч. заведение', 'Высшее',
-       'Профильная Школа', 'СПО', 'Боевые действия', 'Инвалиды',
-       'Квота для иностранных граждан', 'Сироты', 'PostSoviet', 'others',
-       'Код направления 1: 10', 'Код направления 1: 11',
-       'Код направления 1: 27', 'Код направления 1: 29',
-       'Код направления 3: 2', 'Код направления 3: 3', 'Код направления 3: 4'
-]
+
+pool = InferencePool()
+
+
+async def run_batch(education_level: str, X: np.ndarray) -> np.ndarray:
+    # В пул уходят только строки, которых нет в кэше, без повторов внутри батча.
+    # Поиск в кэше и сборка ответа на больших батчах занимают десятки мс,
+    # поэтому тоже идут в потоке, а не в цикле событий.
+    with timed('cache_lookup', education_level, len(X)):
+        batch = await run_in_threadpool(cache_lookup, education_level, X)
+    if not batch.missing:
+        return await run_in_threadpool(batch.fill, np.empty(0))
+    with timed('inference', education_level, len(batch.missing)):
+        predictions = await pool.predict(education_level, batch.missing_rows)
+    return await run_in_threadpool(batch.fill, predictions)
+
+
+def cache_lookup(education_level: str, X: np.ndarray):
+    return prediction_cache.lookup(education_level, get_artifacts().version, X)
+
+
+batchers = {
+    level: MicroBatcher(functools.partial(run_batch, level))
+    for level in ('magistr', 'bak_spec')
+}
+pending_requests = asyncio.Semaphore(MAX_PENDING_REQUESTS)
+
+
+def to_feature_matrix(rows: list, feature_columns: list):
+    data = pd.DataFrame(rows)
+    missing_cols = [col for col in feature_columns if col not in data.columns]
+    if missing_cols:
+        return None, missing_cols
+    return data[feature_columns].to_numpy(dtype=np.float64), []
+
+
+def columnar_matrix(body: bytes, feature_columns: list):
+    # {"columns": [имена], "values": [[значения столбца], ...]}
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("Ожидается JSON-объект с полями columns и values")
+    columns, values = payload.get('columns'), payload.get('values')
+    if not isinstance(columns, list) or not isinstance(values, list) or len(columns) != len(values):
+        raise ValueError("Ожидаются списки columns и values одинаковой длины")
+    if not all(isinstance(col, str) for col in columns) or not all(isinstance(col, list) for col in values):
+        raise ValueError("columns — список имён столбцов, values — список списков значений")
+
+    index = {col: i for i, col in enumerate(columns)}
+    missing_cols = [col for col in feature_columns if col not in index]
+    if missing_cols:
+        return None, missing_cols
+
+    n_rows = len(values[index[feature_columns[0]]]) if feature_columns else 0
+    X = np.empty((n_rows, len(feature_columns)), dtype=np.float64)
+    for j, col in enumerate(feature_columns):
+        try:
+            column = np.asarray(values[index[col]], dtype=np.float64)
+        except (TypeError, ValueError):
+            # Строки и объекты: numpy бросает и TypeError, и ValueError.
+            raise ValueError(f"Столбец {col}: значения должны быть числами")
+        if column.shape != (n_rows,):
+            raise ValueError(f"Столбец {col}: ожидалось {n_rows} значений")
+        if not np.isfinite(column).all():
+            raise ValueError(f"Столбец {col}: пропуски (null) и бесконечности не допускаются")
+        X[:, j] = column
+    return X, []
+
+
+def binary_matrix(body: bytes, feature_columns: list, fingerprint: str):
+    # Тело — массив .npy (float32/float64, C-порядок) со столбцами в порядке
+    # GET /features/{education_level}; заголовок X-Feature-Fingerprint
+    # подтверждает, что клиент собирал матрицу под текущий набор признаков.
+    if fingerprint != feature_fingerprint(feature_columns):
+        raise ValueError("Набор признаков клиента не совпадает с моделью, обновите его через GET /features")
+
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+
+    if dtype.str not in ('<f4', '<f8') or fortran_order or len(shape) != 2:
+        raise ValueError("Ожидается двумерный массив float32/float64 в C-порядке")
+    if shape[1] != len(feature_columns):
+        raise ValueError(f"Ожидалось {len(feature_columns)} признаков, получено {shape[1]}")
+
+    offset = stream.tell()
+    if len(body) - offset != shape[0] * shape[1] * dtype.itemsize:
+        raise ValueError("Размер данных не совпадает с заголовком массива")
+
+    X = np.frombuffer(body, dtype=dtype, count=shape[0] * shape[1], offset=offset).reshape(shape)
+    return (X if dtype.itemsize == 8 else X.astype(np.float64)), []
+
+
+def what_if_variants(education_level: str, profile: dict, axes: list):
+    # Профиль и все варианты сетки — одна матрица, она проходит через общий батчер.
+    schema = form_schema(get_artifacts(), education_level)
+    return what_if_matrix(schema, profile_form(profile, education_level), axes), []
+
+
+async def predict_matrix(education_level: str, build_matrix, *args) -> np.ndarray:
+    # Общая часть всех форматов /predict: очередь, разбор в потоке, батчинг.
+    try:
+        await asyncio.wait_for(pending_requests.acquire(), QUEUE_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Сервер перегружен, повторите запрос позже")
+
+    try:
+        try:
+            with timed('parse', education_level) as timer:
+                X, missing_cols = await run_in_threadpool(build_matrix, *args)
+                timer.rows = len(X) if X is not None else 0
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Некорректные данные: {str(e)}")
+
+        if missing_cols:
+            logger.error(f"Отсутствуют столбцы: {missing_cols}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Отсутствуют обязательные столбцы: {missing_cols}"
+            )
+        logger.debug("Данные преобразованы в матрицу, строк: %d", len(X))
+
+        with timed('batch_wait', education_level, len(X)):
+            return await asyncio.wait_for(batchers[education_level].submit(X), INFERENCE_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Превышено время ожидания предсказания")
+    finally:
+        pending_requests.release()
+
+
+def check_education_level(education_level: str):
+    if education_level not in ['magistr', 'bak_spec']:
+        raise HTTPException(
+            status_code=400,
+            detail="Неправильный уровень образования. Используйте 'magistr' или 'bak_spec'"
+        )
+
+
+def prediction_response(predictions: np.ndarray) -> dict:
+    log_event(logger, "Предсказания сгенерированы", logging.DEBUG, rows=len(predictions))
+    return {
+        "status": "success",
+        "predictions": predictions.tolist(),
+        "count": len(predictions)
+    }
 
 
 class PredictionRequest(BaseModel):
@@ -51,20 +207,56 @@ class PredictionRequest(BaseModel):
     data: list[dict]
 
 
+class WhatIfRequest(BaseModel):
+    education_level: str
+    profile: dict = {}
+    grid: dict
+
+
 @app.get("/")
 async def root():
     return {
         "message": "Student Dropout Prediction API",
         "endpoints": {
             "test": "GET /test",
-            "predict": "POST /predict"
+            "predict": "POST /predict",
+            "predict_columnar": "POST /predict/columnar?education_level=...",
+            "predict_binary": "POST /predict/binary?education_level=... (.npy, X-Feature-Fingerprint, "
+                              "Accept: application/x-npy)",
+            "what_if": "POST /what_if",
+            "features": "GET /features/{education_level}",
+            "metrics": "GET /metrics",
+            "batching_stats": "GET /stats/batching"
         }
     }
 
 
 @app.get("/test")
 async def test_endpoint():
-    return {"status": "API работает корректно", "models_loaded": True}
+    artifacts = get_artifacts()
+    return {
+        "status": "API работает корректно",
+        "models_loaded": True,
+        "models": {level: type(artifacts.model(level)[0]).__name__ for level in ('magistr', 'bak_spec')}
+    }
+
+
+@app.get("/stats/batching")
+async def batching_stats():
+    return {
+        **{level: batcher.stats() for level, batcher in batchers.items()},
+        "pool": pool.stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return prediction_cache.stats()
 
 
 @app.get("/predict")
@@ -73,48 +265,98 @@ async def predict_get():
         "message": "Используйте POST запрос с JSON телом",
         "example_request": {
             "education_level": "magistr",
-            "data": [{col: 0 for col in FEATURE_COLUMNS}]
+            "data": [{col: 0 for col in get_artifacts().features('magistr')}]
         }
     }
 
 
+@app.get("/features/{education_level}")
+async def features(education_level: str):
+    check_education_level(education_level)
+    feature_columns = get_artifacts().features(education_level)
+    return {"columns": feature_columns, "fingerprint": feature_fingerprint(feature_columns)}
+
+
 @app.post("/predict")
 async def predict(request: PredictionRequest):
     try:
-        logger.debug(f"Получен запрос: education_level={request.education_level}")
-        
-        if request.education_level not in ['magistr', 'bak_spec']:
-            raise HTTPException(
-                status_code=400,
-                detail="Неправильный уровень образования. Используйте 'magistr' или 'bak_spec'"
-            )
-        
-        data = pd.DataFrame(request.data)
-        logger.debug(f"Данные преобразованы в DataFrame, строк: {len(data)}")
-        
-        missing_cols = [col for col in FEATURE_COLUMNS if col not in data.columns]
-        if missing_cols:
-            logger.error(f"Отсутствуют столбцы: {missing_cols}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Отсутствуют обязательные столбцы: {missing_cols}"
-            )
-        
-        model = model_magistr if request.education_level == 'magistr' else model_bak_spec
-        
-        if hasattr(model, 'predict_proba'):
-            predictions = model.predict_proba(data[FEATURE_COLUMNS])[:, 1]
-        else:
-            predictions = model.predict(data[FEATURE_COLUMNS]).astype(float)
-        
-        logger.debug(f"Предсказания сгенерированы, пример: {predictions[:5]}")
-        
-        return {
-            "status": "success",
-            "predictions": predictions.tolist(),
-            "count": len(predictions)
-        }
-    
+        logger.debug("Получен запрос: education_level=%s", request.education_level)
+        check_education_level(request.education_level)
+
+        feature_columns = get_artifacts().features(request.education_level)
+        predictions = await predict_matrix(request.education_level, to_feature_matrix,
+                                           request.data, feature_columns)
+        return prediction_response(predictions)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка обработки запроса: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка обработки: {str(e)}"
+        )
+
+
+@app.post("/predict/columnar")
+async def predict_columnar(request: Request, education_level: str):
+    # Тело разбирается без pydantic: валидация строк-словарей на больших
+    # запросах дороже самой модели.
+    try:
+        check_education_level(education_level)
+        feature_columns = get_artifacts().features(education_level)
+        predictions = await predict_matrix(education_level, columnar_matrix, await request.body(), feature_columns)
+        return prediction_response(predictions)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка обработки запроса: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка обработки: {str(e)}"
+        )
+
+
+@app.post("/predict/binary")
+async def predict_binary(request: Request, education_level: str):
+    try:
+        check_education_level(education_level)
+        feature_columns = get_artifacts().features(education_level)
+        fingerprint = request.headers.get('X-Feature-Fingerprint')
+        predictions = await predict_matrix(education_level, binary_matrix, await request.body(),
+                                           feature_columns, fingerprint)
+        if NPY_CONTENT_TYPE in request.headers.get('Accept', ''):
+            # Ответ для model_client: массив .npy вместо JSON.
+            return Response(npy_bytes(np.asarray(predictions, dtype=np.float64)), media_type=NPY_CONTENT_TYPE)
+        return prediction_response(predictions)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка обработки запроса: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка обработки: {str(e)}"
+        )
+
+
+@app.post("/what_if")
+async def what_if(request: WhatIfRequest):
+    try:
+        check_education_level(request.education_level)
+        model, threshold, features = get_artifacts().model(request.education_level)
+        try:
+            axes = parse_grid(request.grid, features)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Некорректные данные: {str(e)}")
+
+        predictions = await predict_matrix(request.education_level, what_if_variants,
+                                           request.education_level, request.profile, axes)
+        return {"status": "success", **what_if_surface(axes, predictions, threshold)}
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка обработки запроса: {str(e)}", exc_info=True)
         raise HTTPException(
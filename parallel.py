@@ -0,0 +1,85 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from log_config import get_logger
+from metrics import METRICS_DIR
+from procutil import model_executor
+
+logger = get_logger(__name__)
+
+# Параллельная обработка больших загрузок: чанки из целых студентов
+# обрабатываются в процессах с уже загруженными моделями.
+# PARALLEL_WORKERS=0 — обработка в процессе запроса, как раньше.
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', 0))
+PARALLEL_SHARD_ROWS = int(os.environ.get('PARALLEL_SHARD_ROWS', 50000))
+PARALLEL_MIN_ROWS = int(os.environ.get('PARALLEL_MIN_ROWS', 20000))
+
+
+def shard_count(rows: int, workers: int, shard_rows: int = PARALLEL_SHARD_ROWS) -> int:
+    return max(workers, -(-rows // max(shard_rows, 1)))
+
+
+class ShardPool:
+    def __init__(self, workers: int = PARALLEL_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def start(self):
+        # Пул создаётся в процессе, который обрабатывает запросы (после fork
+        # мастера gunicorn); модели загружаются до создания процессов пула.
+        with self._lock:
+            if self.executor is not None and self._pid == os.getpid():
+                return
+            self.executor = model_executor(self.workers)
+            self._pid = os.getpid()
+            logger.info(f"Запущен пул параллельной обработки: {self.workers} процессов")
+            if METRICS_DIR is None:
+                logger.warning("METRICS_DIR не задан: время этапов в процессах пула не попадёт в /metrics")
+
+    def shutdown(self):
+        with self._lock:
+            if self.executor is not None and self._pid == os.getpid():
+                self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def map(self, fn, items, *args) -> list:
+        self.start()
+        try:
+            futures = [self.executor.submit(fn, item, *args) for item in items]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            logger.error("Пул параллельной обработки упал, он будет создан заново")
+            self.shutdown()
+            raise
+
+    def imap(self, fn, items, *args, prefetch: int = None):
+        # Для потока чанков: в работе не больше prefetch чанков, результаты
+        # отдаются в порядке поступления чанков.
+        self.start()
+        prefetch = prefetch or self.workers * 2
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(self.executor.submit(fn, item, *args))
+                if len(pending) >= prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool:
+            logger.error("Пул параллельной обработки упал, он будет создан заново")
+            self.shutdown()
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+shard_pool = ShardPool()
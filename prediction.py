@@ -0,0 +1,218 @@
+import io
+import itertools
+import os
+import tempfile
+
+import pandas as pd
+
+from app_func import make_prediction_row, predict_frame, predict_positive
+from artifacts import get_artifacts
+from csv_func import collect_csv_data, prepare_data
+from form_schema import form_schema
+from ingest import (CHUNK_ROWS, STREAM_THRESHOLD_BYTES, frame_student_chunks, iter_student_chunks, open_with_fallback,
+                    read_upload, stream_size)
+from log_config import get_logger, log_event
+from metrics import timed, timed_iter
+from parallel import PARALLEL_MIN_ROWS, shard_count, shard_pool
+from prediction_cache import prediction_cache
+from what_if import parse_grid, profile_form, what_if_matrix, what_if_surface
+
+logger = get_logger(__name__)
+
+# Строк результата на одну часть ответа при потоковой отдаче CSV.
+CSV_WRITE_ROWS = int(os.environ.get('CSV_WRITE_ROWS', 10000))
+
+
+def predict_form(form, education_level: str, artifacts) -> dict:
+    model, threshold, features = artifacts.model(education_level)
+
+    with timed('collect_form_data', education_level, 1):
+        X = form_schema(artifacts, education_level).row(form)
+
+    with timed('inference', education_level, 1):
+        return make_prediction_row(X, model, threshold, features,
+                                   cache_scope=(education_level, artifacts.version))
+
+
+def predict_what_if(profile, grid, education_level: str, artifacts) -> dict:
+    model, threshold, features = artifacts.model(education_level)
+    schema = form_schema(artifacts, education_level)
+    axes = parse_grid(grid, features)
+
+    with timed('collect_form_data', education_level) as timer:
+        X = what_if_matrix(schema, profile_form(profile, education_level), axes)
+        timer.rows = len(X)
+
+    with timed('inference', education_level, len(X)):
+        proba = prediction_cache.predict(education_level, artifacts.version, X,
+                                         lambda rows: predict_positive(model, rows, features))
+    log_event(logger, "Анализ «что если» выполнен", education_level=education_level, variants=len(X) - 1)
+    return what_if_surface(axes, proba, threshold)
+
+
+def stream_predictions(upload, education_level: str, artifacts):
+    # CSV результата по частям (bytes): каждая часть отдаётся, как только
+    # посчитан её чанк. Файл читается и проверяется (кодировка, столбец
+    # id_студента) до начала ответа, первый чанк тоже считается сразу.
+    results = predict_csv_chunks(upload_chunks(upload, education_level), education_level, artifacts)
+    first = next(results, None)
+    if first is None:
+        raise ValueError("В файле нет данных студентов")
+    return csv_chunks(itertools.chain([first], results), education_level)
+
+
+def upload_chunks(upload, education_level: str, progress=None):
+    # Чанки из целых студентов по возрастанию id_студента: файл до порога
+    # читается целиком, больший — через внешнюю сортировку (ingest.py).
+    # progress(доля) — доля строк, отданных на обработку.
+    if stream_size(upload) >= STREAM_THRESHOLD_BYTES:
+        with timed('decode', education_level):
+            _, chunks = open_with_fallback(upload, lambda f, encoding: iter_student_chunks(
+                f, encoding, CHUNK_ROWS, progress=progress))
+        return chunks
+
+    # Строки этапа decode считает predict_csv_chunks по чанкам, как и для большого файла.
+    with timed('decode', education_level):
+        df = read_upload(upload)
+    log_event(logger, "Файл прочитан", education_level=education_level, rows=len(df), columns=len(df.columns))
+    return frame_student_chunks(df, frame_chunk_rows(len(df)), progress=progress)
+
+
+def frame_chunk_rows(rows: int) -> int:
+    # С пулом процессов файл в памяти делится не меньше чем на число процессов.
+    if shard_pool.enabled and rows >= PARALLEL_MIN_ROWS:
+        return min(CHUNK_ROWS, -(-rows // shard_count(rows, shard_pool.workers)))
+    return CHUNK_ROWS
+
+
+def csv_chunks(results, education_level: str):
+    rows = 0
+    for result in results:
+        # Пустой результат всё равно даёт строку заголовка, как to_csv целиком.
+        for start in range(0, len(result) or 1, CSV_WRITE_ROWS):
+            part = result.iloc[start:start + CSV_WRITE_ROWS]
+            with timed('to_csv', education_level, len(part)):
+                data = part.to_csv(index=False, sep=';', header=rows == 0).encode('utf-8')
+            rows += len(part)
+            yield data
+    log_event(logger, "Результат отправлен", education_level=education_level, students=rows)
+
+
+def score_students(df: pd.DataFrame, education_level: str, artifacts=None):
+    # process_student_csv -> prepare_data -> make_prediction_csv для группы
+    # студентов; выполняется и в процессах пула parallel.py. Возвращает
+    # id_студента и результат (id — номер студента в группе) или None.
+    if artifacts is None:
+        artifacts = get_artifacts()
+    model, threshold, features = artifacts.model(education_level)
+    features_mag, features_bak_spec = artifacts.features_mag, artifacts.features_bak_spec
+
+    with timed('process_student_csv', education_level, len(df)):
+        processed = process_student_csv(df, education_level, features_mag, features_bak_spec, artifacts)
+    if processed.empty:
+        return None
+    student_ids = processed['id_студента'].to_numpy()
+    with timed('prepare_data', education_level, len(processed)):
+        prepared = prepare_data(processed, education_level, features_mag, features_bak_spec)
+
+    result = make_prediction_csv(prepared, model, threshold, features, (education_level, artifacts.version))
+    return student_ids, result
+
+
+def process_student_csv(df: pd.DataFrame, education_level: str, features_mag, features_bak_spec, artifacts=None):
+    try:
+        column_mapping = {
+            'Наименование дисциплины': 'subject_name',
+            'Оценка': 'subject_grade',
+            'Баллы': 'subject_score',
+            'Количество пересдач': 'subject_retakes'
+        }
+        df = df.rename(columns=column_mapping)
+
+        return collect_csv_data(df, education_level, features_mag, features_bak_spec, artifacts)
+
+    except Exception as e:
+        logger.error(f"Ошибка обработки CSV: {e}", exc_info=True)
+        raise
+
+
+def make_prediction_csv(df: pd.DataFrame, model, threshold: float, features: list, cache_scope=None):
+    missing = set(features) - set(df.columns)
+    if missing:
+        raise ValueError(f"Отсутствуют обязательные фичи: {missing}")
+
+    with timed('inference', cache_scope[0] if cache_scope else 'unknown', len(df)):
+        proba = predict_frame(df, model, features, cache_scope)
+
+    result_df = pd.DataFrame({
+        'id': df.index if 'id' not in df.columns else df['id'],
+        'probability': (proba * 100).round(2),
+        'above_threshold': proba >= threshold
+    })
+
+    return result_df
+
+
+def predict_csv_chunks(chunks, education_level: str, artifacts):
+    def with_level(chunk):
+        chunk = chunk.copy()
+        chunk['Уровень подготовки'] = 'Магистр' if education_level == 'magistr' else 'Бакалавр'
+        return chunk
+
+    chunks = (with_level(chunk) for chunk in timed_iter('decode', education_level, chunks))
+    if shard_pool.enabled:
+        # Чанки содержат целых студентов и обрабатываются процессами пула
+        # параллельно; результаты идут в порядке чанков.
+        scored = shard_pool.imap(score_students, chunks, education_level)
+    else:
+        scored = (score_students(chunk, education_level, artifacts) for chunk in chunks)
+
+    offset = 0
+    for item in scored:
+        if item is None:
+            continue
+        result = item[1]
+        result['id'] += offset
+        offset += len(result)
+        yield result
+
+
+def predict_file(path: str, output, education_level: str, progress=None) -> int:
+    # Обработка файла фонового задания; результат пишется в output.
+    # progress(доля, студентов) вызывается по мере обработки чанков.
+    artifacts = get_artifacts()
+    students = [0]
+    fraction = [0.0]
+
+    def report(rows: int):
+        students[0] = rows
+        if progress is not None:
+            progress(fraction[0], rows)
+
+    def read(value: float):
+        fraction[0] = value
+
+    with open(path, 'rb') as upload:
+        write_predictions(upload_chunks(upload, education_level, read), education_level, artifacts, output, report)
+    return students[0]
+
+
+def write_predictions(chunks, education_level: str, artifacts, output=None, progress=None):
+    if output is None:
+        output = tempfile.TemporaryFile()
+    writer = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    rows = 0
+    for result in predict_csv_chunks(chunks, education_level, artifacts):
+        with timed('to_csv', education_level, len(result)):
+            result.to_csv(writer, index=False, sep=';', header=rows == 0)
+        rows += len(result)
+        if progress is not None:
+            progress(rows)
+    if rows == 0:
+        raise ValueError("В файле нет данных студентов")
+
+    writer.flush()
+    writer.detach()
+    output.seek(0)
+    log_event(logger, "Потоковая обработка завершена", education_level=education_level, students=rows)
+    return output
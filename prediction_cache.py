@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 100000))
+PREDICTION_CACHE_TTL_S = float(os.environ.get('PREDICTION_CACHE_TTL_S', 3600))
+
+
+def row_bytes(X: np.ndarray) -> list:
+    # Адрес строки — байты подготовленного вектора признаков: одинаковые
+    # студенты дают одинаковый ключ без риска коллизий хэша.
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    return X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).ravel().tolist()
+
+
+class CachedBatch:
+    def __init__(self, cache, keys, values, inverse, n_features):
+        self.cache = cache
+        self.keys = keys
+        self.values = values
+        self.inverse = inverse
+        self.missing = [i for i, value in enumerate(values) if value is None]
+        raw = b''.join(keys[i][2] for i in self.missing)
+        self.missing_rows = np.frombuffer(raw, dtype=np.float64).reshape(len(self.missing), n_features)
+
+    def fill(self, predictions: np.ndarray) -> np.ndarray:
+        predictions = np.asarray(predictions, dtype=np.float64)
+        if len(predictions) != len(self.missing):
+            raise ValueError(f"Ожидалось {len(self.missing)} предсказаний, получено {len(predictions)}")
+        for i, value in zip(self.missing, predictions.tolist()):
+            self.values[i] = value
+        self.cache.put_many([self.keys[i] for i in self.missing], predictions.tolist())
+        return np.array(self.values, dtype=np.float64)[self.inverse]
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int = PREDICTION_CACHE_SIZE, ttl_s: float = PREDICTION_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.deduplicated = 0
+
+    def lookup(self, education_level: str, version: str, X: np.ndarray) -> CachedBatch:
+        self._check_version(education_level, version)
+
+        # Повторяющиеся строки схлопываются до обращения к кэшу и инференса.
+        index = {}
+        inverse = np.fromiter((index.setdefault(raw, len(index)) for raw in row_bytes(X)),
+                              dtype=np.intp, count=len(X))
+        keys = [(education_level, version, raw) for raw in index]
+        with self._lock:
+            self.deduplicated += len(X) - len(keys)
+
+        if self.max_entries <= 0:
+            values = [None] * len(keys)
+        else:
+            values = self.get_many(keys)
+        return CachedBatch(self, keys, values, inverse, X.shape[1])
+
+    def predict(self, education_level: str, version: str, X: np.ndarray, predict) -> np.ndarray:
+        batch = self.lookup(education_level, version, X)
+        if batch.missing:
+            return batch.fill(predict(batch.missing_rows))
+        return batch.fill(np.empty(0))
+
+    def get_many(self, keys: list) -> list:
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    del self._entries[key]
+                    self.expired += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    values.append(None)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                values.append(entry[0])
+        return values
+
+    def put_many(self, keys: list, values: list):
+        if self.max_entries <= 0:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (value, expires)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_version(self, education_level: str, version: str):
+        # При смене артефактов старые записи недостижимы (версия входит в ключ),
+        # но занимают место до вытеснения, поэтому кэш сбрасывается сразу.
+        previous = self._versions.get(education_level)
+        if previous == version:
+            return
+        self._versions[education_level] = version
+        if previous is not None:
+            logger.info(f"Версия артефактов изменилась ({previous} -> {version}), кэш предсказаний сброшен")
+            self.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "deduplicated_rows": self.deduplicated,
+            }
+
+
+prediction_cache = PredictionCache()
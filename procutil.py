@@ -0,0 +1,20 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from artifacts import get_artifacts
+
+
+def init_worker():
+    get_artifacts()
+
+
+def model_executor(workers: int) -> ProcessPoolExecutor:
+    # Общий для inference_pool.py и parallel.py пул процессов с моделями.
+    # Модели загружаются до создания процессов: при fork рабочие процессы
+    # получают их страницы памяти без копирования и повторной загрузки.
+    get_artifacts()
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    return ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker)
@@ -0,0 +1,137 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+
+from compiled_models import mmap_npz
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+# Данные ранжирования уровня одним файлом models/rank_bundle_<уровень>.npz
+# вместо subject_stats_*.pkl и sorted_penalties_*.pkl:
+#   subject_blob, subject_offsets — названия дисциплин (UTF-8 подряд и границы);
+#   mean_clean, fail_ratio — float64 в порядке названий;
+#   penalties — отсортированные штрафы, float64.
+# Архив без сжатия, массивы отображаются в память без распаковки.
+RANK_BUNDLE_DIR = os.environ.get('RANK_BUNDLE_DIR', 'models')
+RANK_BUNDLE_FORMAT = 1
+
+
+def bundle_path(education_level: str, directory: str = RANK_BUNDLE_DIR) -> str:
+    return os.path.join(directory, f'rank_bundle_{education_level}.npz')
+
+
+def pickle_paths(education_level: str, directory: str = RANK_BUNDLE_DIR):
+    return (os.path.join(directory, f'subject_stats_{education_level}.pkl'),
+            os.path.join(directory, f'sorted_penalties_{education_level}.pkl'))
+
+
+def pack_names(names) -> tuple:
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_names(blob, offsets) -> list:
+    data = bytes(blob)
+    bounds = offsets.tolist()
+    return [sys.intern(data[start:end].decode('utf-8')) for start, end in zip(bounds, bounds[1:])]
+
+
+class RankBundle:
+    def __init__(self, subjects, mean_clean, fail_ratio, penalties):
+        self.subjects = list(subjects)
+        self.mean_clean = mean_clean
+        self.fail_ratio = fail_ratio
+        self.penalties = penalties
+        self.subject_index = {name: i for i, name in enumerate(self.subjects)}
+
+    @classmethod
+    def from_pickles(cls, education_level: str, directory: str = RANK_BUNDLE_DIR) -> 'RankBundle':
+        stats_path, penalties_path = pickle_paths(education_level, directory)
+        with open(stats_path, 'rb') as f:
+            stats = pickle.load(f)
+        with open(penalties_path, 'rb') as f:
+            penalties = pickle.load(f)
+        return cls(
+            list(stats),
+            np.array([stats[name]['mean_clean'] for name in stats], dtype=np.float64),
+            np.array([stats[name]['fail_ratio'] for name in stats], dtype=np.float64),
+            np.sort(np.asarray(penalties, dtype=np.float64)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.subjects)
+
+
+def save_bundle(bundle: RankBundle, path: str):
+    blob, offsets = pack_names(bundle.subjects)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, format=np.int64(RANK_BUNDLE_FORMAT), subject_blob=blob, subject_offsets=offsets,
+                 mean_clean=np.asarray(bundle.mean_clean, dtype=np.float64),
+                 fail_ratio=np.asarray(bundle.fail_ratio, dtype=np.float64),
+                 penalties=np.asarray(bundle.penalties, dtype=np.float64))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_bundle(path: str) -> RankBundle:
+    arrays = mmap_npz(path)
+    if arrays is None:
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+    if int(arrays['format']) != RANK_BUNDLE_FORMAT:
+        raise ValueError(f"{path}: формат {int(arrays['format'])}, ожидался {RANK_BUNDLE_FORMAT}")
+    return RankBundle(unpack_names(arrays['subject_blob'], arrays['subject_offsets']),
+                      arrays['mean_clean'], arrays['fail_ratio'], arrays['penalties'])
+
+
+def load_rank_bundle(education_level: str, directory: str = RANK_BUNDLE_DIR) -> RankBundle:
+    path = bundle_path(education_level, directory)
+    if os.path.exists(path):
+        return load_bundle(path)
+    logger.warning(f"Нет {path}, данные рангов читаются из pickle "
+                   f"(создать: python rank_bundle.py convert {education_level})")
+    return RankBundle.from_pickles(education_level, directory)
+
+
+def convert(education_level: str, directory: str = RANK_BUNDLE_DIR) -> str:
+    path = bundle_path(education_level, directory)
+    save_bundle(RankBundle.from_pickles(education_level, directory), path)
+    logger.info(f"Данные рангов {education_level} сохранены в {path} ({os.path.getsize(path)} байт)")
+    return path
+
+
+def verify(education_level: str, directory: str = RANK_BUNDLE_DIR) -> bool:
+    expected = RankBundle.from_pickles(education_level, directory)
+    actual = load_bundle(bundle_path(education_level, directory))
+    ok = (actual.subjects == expected.subjects
+          and np.array_equal(actual.mean_clean, expected.mean_clean)
+          and np.array_equal(actual.fail_ratio, expected.fail_ratio)
+          and np.array_equal(actual.penalties, expected.penalties))
+    if ok:
+        logger.info(f"{education_level}: набор совпадает с pickle ({len(actual)} дисциплин, "
+                    f"{len(actual.penalties)} штрафов)")
+    else:
+        logger.error(f"{education_level}: набор расходится с pickle")
+    return ok
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'convert'
+    levels = sys.argv[2:] or ['magistr', 'bak_spec']
+    success = True
+    for level in levels:
+        if command == 'convert':
+            convert(level)
+            success = verify(level) and success
+        elif command == 'verify':
+            success = verify(level) and success
+        else:
+            raise SystemExit(f"Неизвестная команда {command}, используйте convert или verify")
+    sys.exit(0 if success else 1)
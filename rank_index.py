@@ -0,0 +1,249 @@
+import os
+import struct
+import sys
+
+import numpy as np
+
+from compiled_models import mmap_npz
+from log_config import get_logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# Распределение штрафов для ранжирования с пополнением без полной пересборки.
+#   models/rank_index_<уровень>.npz — отсортированная база (values, generation);
+#   models/rank_index_<уровень>.log — заголовок generation и добавленные штрафы (float64).
+# Ранг = число штрафов <= штрафа студента + 1, как bisect_right по списку из
+# rank_bundle_<уровень>.npz. Запросы — два бинарных поиска (база и дельта).
+RANK_INDEX_DIR = os.environ.get('RANK_INDEX_DIR', 'models')
+# Дельта сливается с базой, когда превышает эту долю базы (и не меньше COMPACT_MIN).
+RANK_INDEX_COMPACT_RATIO = float(os.environ.get('RANK_INDEX_COMPACT_RATIO', 0.1))
+RANK_INDEX_COMPACT_MIN = int(os.environ.get('RANK_INDEX_COMPACT_MIN', 4096))
+LOG_HEADER = struct.Struct('<q')
+
+
+def index_paths(education_level: str, directory: str = RANK_INDEX_DIR):
+    prefix = os.path.join(directory, f'rank_index_{education_level}')
+    return prefix + '.npz', prefix + '.log'
+
+
+def merge_sorted(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if not len(b):
+        return np.asarray(a, dtype=np.float64)
+    return np.insert(np.asarray(a, dtype=np.float64), np.searchsorted(a, b, side='right'), b)
+
+
+def read_log(path: str, generation: int) -> np.ndarray:
+    # Журнал другого поколения уже влит в базу (сбой между записью базы и
+    # сбросом журнала). Оборванная последняя запись отбрасывается.
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(LOG_HEADER.size)
+            data = f.read()
+    except FileNotFoundError:
+        return np.empty(0)
+    if len(header) < LOG_HEADER.size or LOG_HEADER.unpack(header)[0] != generation:
+        return np.empty(0)
+    usable = len(data) - len(data) % 8
+    return np.frombuffer(data[:usable], dtype=np.float64)
+
+
+class RankIndex:
+    def __init__(self, base, delta=None, generation: int = 0, base_path: str = None, log_path: str = None):
+        self.base = base
+        self.delta = np.sort(np.asarray(delta if delta is not None else [], dtype=np.float64))
+        self.generation = generation
+        self.base_path = base_path
+        self.log_path = log_path
+
+    @classmethod
+    def from_values(cls, values) -> 'RankIndex':
+        if isinstance(values, RankIndex):
+            return values
+        values = np.asarray(values, dtype=np.float64)
+        if (values[1:] < values[:-1]).any():
+            values = np.sort(values)
+        return cls(values)
+
+    @classmethod
+    def load(cls, education_level: str, directory: str = RANK_INDEX_DIR, fallback=None) -> 'RankIndex':
+        base_path, log_path = index_paths(education_level, directory)
+        if not os.path.exists(base_path):
+            if fallback is None:
+                raise FileNotFoundError(base_path)
+            # Индекс ещё не создан: база — штрафы из набора данных рангов, без журнала.
+            return cls.from_values(fallback)
+
+        arrays = mmap_npz(base_path)
+        if arrays is None:
+            with np.load(base_path) as data:
+                arrays = {key: data[key] for key in data.files}
+        generation = int(arrays['generation'])
+        return cls(arrays['values'], read_log(log_path, generation), generation, base_path, log_path)
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.delta)
+
+    def count_le(self, penalties) -> np.ndarray:
+        penalties = np.asarray(penalties, dtype=np.float64)
+        return (np.searchsorted(self.base, penalties, side='right') +
+                np.searchsorted(self.delta, penalties, side='right'))
+
+    def ranks(self, penalties) -> np.ndarray:
+        return self.count_le(penalties) + 1
+
+    def rank(self, penalty: float) -> int:
+        return int(self.count_le(penalty)) + 1
+
+    def percentile(self, penalties):
+        # Доля эталонных штрафов не больше данного, в процентах.
+        return 100.0 * self.count_le(penalties) / max(len(self), 1)
+
+    def insert(self, penalties) -> int:
+        penalties = np.sort(np.asarray(penalties, dtype=np.float64).ravel())
+        if not np.isfinite(penalties).all():
+            raise ValueError("Штрафы должны быть конечными числами")
+        if not len(penalties):
+            return 0
+        if self.log_path is None:
+            raise ValueError("Индекс без файлов: создайте его командой init")
+
+        with self._locked():
+            self._sync()
+            with open(self.log_path, 'ab') as f:
+                f.write(penalties.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.delta = merge_sorted(self.delta, penalties)
+
+            if len(self.delta) >= max(RANK_INDEX_COMPACT_MIN, RANK_INDEX_COMPACT_RATIO * len(self.base)):
+                self._compact()
+        return len(penalties)
+
+    def compact(self):
+        with self._locked():
+            self._sync()
+            self._compact()
+
+    def _compact(self):
+        values = merge_sorted(self.base, self.delta)
+        generation = self.generation + 1
+        write_base(self.base_path, values, generation)
+        write_log(self.log_path, generation)
+        self.base, self.delta, self.generation = values, np.empty(0), generation
+        logger.info(f"Индекс рангов {self.base_path} сжат: {len(values)} штрафов, поколение {generation}")
+
+    def _sync(self):
+        # Под блокировкой: другой процесс мог сжать индекс, а сбой между записью
+        # базы и сбросом журнала оставляет журнал старого поколения.
+        with np.load(self.base_path) as data:
+            base_generation = int(data['generation'])
+        if base_generation != self.generation or self._log_generation() != self.generation:
+            self._reload()
+
+    def _log_generation(self):
+        try:
+            with open(self.log_path, 'rb') as f:
+                header = f.read(LOG_HEADER.size)
+        except FileNotFoundError:
+            return None
+        return LOG_HEADER.unpack(header)[0] if len(header) == LOG_HEADER.size else None
+
+    def _reload(self):
+        with np.load(self.base_path) as data:
+            self.base, self.generation = data['values'], int(data['generation'])
+        self.delta = np.array(read_log(self.log_path, self.generation))
+        if self._log_generation() != self.generation:
+            write_log(self.log_path, self.generation)
+
+    def _locked(self):
+        return FileLock(self.log_path + '.lock')
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def write_base(path: str, values: np.ndarray, generation: int):
+    # Без сжатия, чтобы базу можно было отобразить в память (mmap_npz).
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, values=np.asarray(values, dtype=np.float64), generation=np.int64(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_log(path: str, generation: int):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(LOG_HEADER.pack(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def init(education_level: str, directory: str = RANK_INDEX_DIR) -> RankIndex:
+    from rank_bundle import bundle_path, load_rank_bundle
+
+    source = bundle_path(education_level, directory)
+    values = np.sort(load_rank_bundle(education_level, directory).penalties)
+    base_path, log_path = index_paths(education_level, directory)
+    write_base(base_path, values, 0)
+    write_log(log_path, 0)
+    logger.info(f"Индекс рангов {base_path} создан из {source}: {len(values)} штрафов")
+    return RankIndex.load(education_level, directory)
+
+
+def cohort_penalties(path: str, education_level: str) -> np.ndarray:
+    # Штрафы новой когорты из CSV в формате загрузки — так же, как при ранжировании.
+    import csv_func
+    from artifacts import get_artifacts
+    from ingest import read_upload
+
+    with open(path, 'rb') as f:
+        df = read_upload(f)
+    arrays, _ = csv_func.rank_arrays(get_artifacts(), education_level)
+    return csv_func.cohort_penalties(df, arrays)
+
+
+if __name__ == '__main__':
+    # python rank_index.py init magistr
+    # python rank_index.py add-cohort magistr cohort.csv
+    # python rank_index.py compact magistr
+    # python rank_index.py stats magistr
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if len(sys.argv) < 3:
+        raise SystemExit("Использование: python rank_index.py init|add-cohort|compact|stats <уровень> [файл]")
+    level = sys.argv[2]
+    if command == 'init':
+        index = init(level)
+    elif command == 'add-cohort':
+        index = RankIndex.load(level)
+        added = index.insert(cohort_penalties(sys.argv[3], level))
+        print(f"Добавлено штрафов: {added}")
+    elif command == 'compact':
+        index = RankIndex.load(level)
+        index.compact()
+    elif command == 'stats':
+        index = RankIndex.load(level)
+    else:
+        raise SystemExit(f"Неизвестная команда {command}")
+    print(f"{level}: база {len(index.base)}, дельта {len(index.delta)}, поколение {index.generation}")
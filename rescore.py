@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import get_artifacts
+from ingest import iter_student_chunks, open_with_fallback
+from log_config import get_logger, log_event
+from prediction import score_students
+
+logger = get_logger(__name__)
+
+# Ночной пересчёт когорты: для каждого студента хранится хэш его строк во
+# входном файле и последнее предсказание. Модель вызывается только для
+# студентов, у которых изменились строки, и для всех при смене версии
+# артефактов (модели, данные рангов, индекс рангов).
+RESCORE_STORE = os.environ.get('RESCORE_STORE', 'rescore.sqlite3')
+KEY = 'id_студента'
+
+
+class ScoreStore:
+    def __init__(self, path: str = RESCORE_STORE):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                education_level TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                version TEXT NOT NULL,
+                probability REAL NOT NULL,
+                above_threshold INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (education_level, student_id)
+            )""")
+
+    def load(self, education_level: str) -> dict:
+        rows = self.db.execute('SELECT student_id, hash, version, probability, above_threshold FROM scores '
+                               'WHERE education_level = ?', (education_level,))
+        return {student_id: (bytes(digest), version, probability, bool(above))
+                for student_id, digest, version, probability, above in rows}
+
+    def save(self, education_level: str, rows: list, stale: list):
+        # rows: (id, хэш, версия, вероятность, выше порога); одна транзакция.
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                [(education_level, student_id, digest, version, probability, int(above), now)
+                                 for student_id, digest, version, probability, above in rows])
+            self.db.executemany('DELETE FROM scores WHERE education_level = ? AND student_id = ?',
+                                [(education_level, student_id) for student_id in stale])
+
+    def close(self):
+        self.db.close()
+
+
+def student_hashes(chunk: pd.DataFrame):
+    # Хэш строк студента в порядке файла вместе с заголовком и типами столбцов:
+    # строки сравниваются в том виде, в каком их видит collect_csv_data. Если
+    # тип столбца в чанке поменялся (4 и 4.0), студент просто пересчитывается.
+    codes, student_ids = pd.factorize(chunk[KEY], sort=True)
+    row_hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+    header = '\x1f'.join(f'{name}:{dtype}' for name, dtype in chunk.dtypes.items()).encode('utf-8')
+
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    bounds = np.searchsorted(codes[order], np.arange(1, len(student_ids)))
+    digests = [hashlib.blake2b(header + row_hashes[rows].tobytes(), digest_size=16).digest()
+               for rows in np.split(order, bounds)]
+    return [str(student_id) for student_id in student_ids], digests
+
+
+def rescore_chunks(chunks, education_level: str, stored: dict, artifacts, full: bool = False):
+    # Отдаёт (результат чанка, новые записи хранилища, id студентов чанка);
+    # порядок и нумерация как у predict_csv_chunks.
+    level_name = 'Магистр' if education_level == 'magistr' else 'Бакалавр'
+    offset = 0
+    for chunk in chunks:
+        keys, digests = student_hashes(chunk)
+        if not keys:
+            continue
+        changed = [full or stored.get(key, (None, None))[:2] != (digest, artifacts.version)
+                   for key, digest in zip(keys, digests)]
+
+        probability = np.empty(len(keys))
+        above = np.empty(len(keys), dtype=bool)
+        updates = []
+        if any(changed):
+            changed_keys = {key for key, flag in zip(keys, changed) if flag}
+            rows = chunk[chunk[KEY].map(str).isin(changed_keys)].copy()
+            rows['Уровень подготовки'] = level_name
+            scored_ids, result = score_students(rows, education_level, artifacts)
+            scored = dict(zip(map(str, scored_ids), zip(result['probability'], result['above_threshold'])))
+        for i, (key, digest, flag) in enumerate(zip(keys, digests, changed)):
+            if flag:
+                probability[i], above[i] = scored[key]
+                updates.append((key, digest, artifacts.version, float(probability[i]), bool(above[i])))
+            else:
+                probability[i], above[i] = stored[key][2:]
+
+        result = pd.DataFrame({
+            'id': np.arange(offset, offset + len(keys)),
+            KEY: keys,
+            'probability': probability,
+            'above_threshold': above,
+        })
+        offset += len(keys)
+        yield result, updates, keys
+
+
+def rescore_file(path: str, output: str, education_level: str, store: ScoreStore,
+                 full: bool = False, prune: bool = True) -> dict:
+    artifacts = get_artifacts()
+    stored = store.load(education_level)
+    started = time.perf_counter()
+
+    with open(path, 'rb') as source:
+        _, stats = open_with_fallback(source, lambda f, encoding: write_merged(
+            iter_student_chunks(f, encoding), output, education_level, stored, artifacts, full))
+
+    # Хранилище обновляется после записи результата: при сбое следующий запуск
+    # просто пересчитает больше студентов.
+    updates, seen = stats.pop('updates'), stats.pop('seen')
+    stale = [key for key in stored if key not in seen] if prune else []
+    store.save(education_level, updates, stale)
+
+    stats.update(rescored=len(updates), reused=stats['students'] - len(updates), pruned=len(stale),
+                 duration_s=round(time.perf_counter() - started, 3))
+    log_event(logger, "Пересчёт когорты завершён", education_level=education_level, **stats)
+    return stats
+
+
+def write_merged(chunks, output: str, education_level: str, stored: dict, artifacts, full: bool) -> dict:
+    partial = f'{output}.part'
+    updates, seen = [], set()
+    students = 0
+    try:
+        with open(partial, 'w', encoding='utf-8', newline='') as f:
+            for result, chunk_updates, keys in rescore_chunks(chunks, education_level, stored, artifacts, full):
+                result.to_csv(f, index=False, sep=';', header=students == 0)
+                students += len(result)
+                updates.extend(chunk_updates)
+                seen.update(keys)
+        if students == 0:
+            raise ValueError("В файле нет данных студентов")
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return {'students': students, 'updates': updates, 'seen': seen}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Пересчёт предсказаний только для изменившихся студентов")
+    parser.add_argument('education_level', choices=['magistr', 'bak_spec'])
+    parser.add_argument('input', help="CSV когорты в формате загрузки, отсортированный по id_студента")
+    parser.add_argument('output', help="CSV с предсказаниями для всех студентов")
+    parser.add_argument('--store', default=RESCORE_STORE, help="файл SQLite с хэшами и предсказаниями")
+    parser.add_argument('--full', action='store_true', help="пересчитать всех студентов")
+    parser.add_argument('--keep-missing', action='store_true',
+                        help="не удалять из хранилища студентов, которых нет во входном файле")
+    args = parser.parse_args(argv)
+
+    store = ScoreStore(args.store)
+    try:
+        stats = rescore_file(args.input, args.output, args.education_level, store,
+                             full=args.full, prune=not args.keep_missing)
+    finally:
+        store.close()
+    print(f"{args.education_level}: студентов {stats['students']}, пересчитано {stats['rescored']}, "
+          f"из хранилища {stats['reused']}, удалено {stats['pruned']}, {stats['duration_s']} с")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -192,6 +192,33 @@ document.addEventListener('DOMContentLoaded', function() {
         window.location.href = `/download_example/${educationLevel}`;
     }
 
+    // Большие файлы обрабатываются фоновым заданием: статус опрашивается,
+    // по готовности результат скачивается.
+    function pollJob(element) {
+        const progress = element.querySelector('.job-progress');
+        fetch(element.dataset.statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'done') {
+                    progress.textContent = `Готово: ${job.students} студентов`;
+                    window.location.href = job.download_url;
+                } else if (job.status === 'failed') {
+                    progress.textContent = `Ошибка обработки файла: ${job.error}`;
+                } else if (job.error) {
+                    progress.textContent = job.error;
+                } else {
+                    progress.textContent = `Обработано ${Math.round(job.progress * 100)}%`;
+                    setTimeout(() => pollJob(element), 2000);
+                }
+            })
+            .catch(() => setTimeout(() => pollJob(element), 5000));
+    }
+
+    const jobStatus = document.getElementById('job-status');
+    if (jobStatus) {
+        pollJob(jobStatus);
+    }
+
     document.querySelectorAll('[onclick^="downloadExample"]').forEach(btn => {
         btn.addEventListener('click', function() {
             const educationLevel = this.getAttribute('onclick').match(/downloadExample\('(\w+)'\)/)[1];
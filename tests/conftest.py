@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# Модули лежат в корне репозитория и открывают models/, static/ по
+# относительным путям — тесты запускаются из корня.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return ROOT
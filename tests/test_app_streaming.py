@@ -0,0 +1,70 @@
+import http.client
+import io
+import threading
+import uuid
+
+import numpy as np
+import pytest
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import app
+import prediction
+from benchmarks.cohort import cohort_csv, generate_cohort
+
+KEY = 'id_студента'
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(prediction, 'CHUNK_ROWS', 200)
+    monkeypatch.setattr(prediction, 'CSV_WRITE_ROWS', 50)
+
+
+class Http10Handler(WSGIRequestHandler):
+    # Без chunked конец ответа — закрытие соединения.
+    protocol_version = 'HTTP/1.0'
+
+
+@pytest.fixture(params=[WSGIRequestHandler, Http10Handler], ids=['chunked', 'http10'])
+def server(request):
+    httpd = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=request.param)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    thread.join()
+
+
+def broken_cohort(student):
+    # У студента пустой код направления: process_student_csv падает на его чанке.
+    df = generate_cohort('magistr', 2000, seed=3).sort_values(KEY, kind='stable')
+    ids = np.sort(df[KEY].unique())
+    df.loc[df[KEY] == ids[student], 'direction'] = np.nan
+    return cohort_csv(df)
+
+
+def post_upload(httpd, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="education_level"\r\n\r\nmagistr\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="x.csv"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    connection = http.client.HTTPConnection('127.0.0.1', httpd.server_port, timeout=60)
+    connection.request('POST', '/predict', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    return connection.getresponse()
+
+
+def test_error_in_first_chunk_returns_error_page():
+    response = app.app.test_client().post('/predict', data={
+        'education_level': 'magistr', 'file': (io.BytesIO(broken_cohort(0)), 'x.csv')})
+
+    assert response.mimetype == 'text/html'
+    assert 'Некорректный код направления' in response.get_data(as_text=True)
+
+
+def test_error_mid_body_aborts_connection(server):
+    response = post_upload(server, broken_cohort(-1))
+
+    assert response.status == 200
+    assert response.getheader('Content-Type').startswith('text/csv')
+    with pytest.raises((http.client.IncompleteRead, ConnectionResetError)):
+        response.read()
@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from werkzeug.datastructures import ImmutableMultiDict
+
+from artifacts import get_artifacts
+from benchmarks.cohort import cohort_csv, generate_cohort
+from csv_func import collect_csv_data, collect_form_data, prepare_data
+from ingest import read_upload
+
+KEY = 'id_студента'
+COLUMN_MAPPING = {
+    'Наименование дисциплины': 'subject_name',
+    'Оценка': 'subject_grade',
+    'Баллы': 'subject_score',
+    'Количество пересдач': 'subject_retakes',
+}
+
+
+def row_by_row(df, education_level, artifacts):
+    # Прежняя обработка CSV: форма из строк каждого студента и collect_form_data.
+    prefix = 'm_' if education_level == 'magistr' else 'b_'
+    processed = []
+    for student_id, group in df.groupby(KEY):
+        items = list(group.iloc[0].to_dict().items())
+        for _, row in group.iterrows():
+            items += [(f'{prefix}subject_name[]', str(row.get('subject_name', ''))),
+                      (f'{prefix}subject_grade[]', str(row.get('subject_grade', ''))),
+                      (f'{prefix}subject_score[]', str(row.get('subject_score', ''))),
+                      (f'{prefix}subject_retakes[]', str(row.get('subject_retakes', 0)))]
+        form = ImmutableMultiDict(items)
+        processed.append({KEY: student_id, **collect_form_data(form, education_level, artifacts.features_mag,
+                                                                artifacts.features_bak_spec, artifacts)})
+    return pd.DataFrame(processed)
+
+
+def messy_cohort(education_level, seed):
+    df = generate_cohort(education_level, 2000, seed=seed)
+    ids = df[KEY].unique()
+    # Студент только с неизвестными дисциплинами и студент без дисциплин вовсе.
+    df.loc[df[KEY] == ids[3], 'Наименование дисциплины'] = 'Неизвестная дисциплина'
+    no_subjects = df[KEY] == ids[7]
+    df.loc[no_subjects, 'Наименование дисциплины'] = np.nan
+    df.loc[no_subjects, ['Оценка', 'Баллы']] = np.nan
+    # Пропуски в отдельных строках и повторённые строки.
+    rows = df.sample(frac=0.05, random_state=seed).index
+    df.loc[rows[::2], 'Оценка'] = np.nan
+    df.loc[rows[1::2], 'Баллы'] = np.nan
+    df = pd.concat([df, df.sample(60, random_state=seed)], ignore_index=True)
+
+    df = read_upload(io.BytesIO(cohort_csv(df)))
+    df['Уровень подготовки'] = 'Магистр' if education_level == 'magistr' else 'Бакалавр'
+    return df.rename(columns=COLUMN_MAPPING)
+
+
+@pytest.mark.parametrize('education_level', ['magistr', 'bak_spec'])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_collect_csv_data_matches_row_by_row(education_level, seed):
+    artifacts = get_artifacts()
+    features = artifacts.model(education_level)[2]
+    df = messy_cohort(education_level, seed)
+
+    expected = row_by_row(df, education_level, artifacts)
+    actual = collect_csv_data(df, education_level, artifacts.features_mag, artifacts.features_bak_spec, artifacts)
+    assert actual[KEY].tolist() == expected[KEY].tolist()
+
+    expected, actual = (prepare_data(frame, education_level, artifacts.features_mag, artifacts.features_bak_spec)
+                        for frame in (expected, actual))
+    np.testing.assert_allclose(actual[features].to_numpy(dtype=np.float64),
+                               expected[features].to_numpy(dtype=np.float64), rtol=1e-12, atol=1e-12)
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from compiled_models import COMPILED_MODELS, example_features, load_compiled, verify
+
+
+@pytest.mark.parametrize('education_level', list(COMPILED_MODELS))
+def test_verify(education_level):
+    assert verify(education_level)
+
+
+@pytest.mark.parametrize('education_level', list(COMPILED_MODELS))
+def test_matches_pipeline_on_random_rows(education_level):
+    import joblib
+
+    source_path, compiled_path, kind = COMPILED_MODELS[education_level]
+    compiled = load_compiled(compiled_path, source_path)
+    assert compiled is not None, f"{compiled_path} устарел, запустите python compiled_models.py convert"
+
+    pipeline = joblib.load(source_path)
+    X = pd.DataFrame(example_features(education_level, n_random=20000, seed=7), columns=compiled.feature_names)
+    expected = pipeline.predict_proba(X)
+    actual = compiled.predict_proba(X)
+    assert actual.shape == expected.shape
+    assert np.abs(actual - expected).max() <= kind.verify_atol
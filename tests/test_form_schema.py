@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifacts import get_artifacts
+from benchmarks.cohort import generate_cohort
+from benchmarks.run import student_forms
+from csv_func import HDI_DICT, collect_form_data, prepare_data
+from form_schema import form_schema
+
+LEVELS = ['magistr', 'bak_spec']
+GRADES = ['5', '4', '3', '2', 'Зачёт', 'Незачёт', '', 'зач.', 'незач.']
+SCORES = ['', '39', '40', '90.5', 'nan', 'abc', '0']
+
+
+def reference_row(form, education_level, artifacts):
+    data = collect_form_data(form, education_level, artifacts.features_mag, artifacts.features_bak_spec, artifacts)
+    df = prepare_data(pd.DataFrame([data]), education_level, artifacts.features_mag, artifacts.features_bak_spec)
+    return df[artifacts.model(education_level)[2]].to_numpy(dtype=np.float64)
+
+
+def fuzz(form, education_level, subjects, rng):
+    # Часть форм портится: редкие и неизвестные значения полей, дисциплины
+    # вне набора рангов, неполные списки оценок и баллов, пропущенные поля.
+    r = rng.random()
+    if r < 0.2:
+        form['country'] = rng.choice(list(HDI_DICT) + ['Марс', ''])
+        form['direction'] = rng.choice(['10.05.03', '27.04.02', '1', '', '29.03.04', '11'])
+        form['level'] = rng.choice(['Бакалавр', 'Специалист', 'x'])
+        form['Тип олимпиады'] = rng.choice(['Не писал', 'всероссийская олимпиада школьников (ВОШ)'])
+        form['Тип законченного учреждения'] = rng.choice(['СПО', 'Высшее', 'Школа'])
+        form['benefit'] = rng.choice(['Сироты', 'Нет'])
+        form['form'] = rng.choice(['Заочная', 'Очная'])
+    elif r < 0.3:
+        prefix = 'b_' if education_level == 'bak_spec' else 'm_'
+        k = rng.randint(0, 6)
+        form.setlist(f'{prefix}subject_name[]', [rng.choice(subjects + ['Неизв']) for _ in range(k)])
+        form.setlist(f'{prefix}subject_grade[]', [rng.choice(GRADES) for _ in range(rng.randint(0, k))])
+        form.setlist(f'{prefix}subject_score[]', [rng.choice(SCORES) for _ in range(rng.randint(0, k))])
+        form.setlist(f'{prefix}subject_retakes[]', [str(rng.randint(0, 3)) for _ in range(k)])
+    elif r < 0.35:
+        for key in ['priority', 'age', 'country', 'direction']:
+            form.pop(key, None)
+    return form
+
+
+@pytest.mark.parametrize('education_level', LEVELS)
+def test_row_matches_collect_form_data(education_level):
+    artifacts = get_artifacts()
+    schema = form_schema(artifacts, education_level)
+    subjects = list(schema.rank_tables[0])
+    rng = random.Random(3)
+
+    forms = student_forms(generate_cohort(education_level, 6000, seed=4), education_level, 400)
+    mismatches = []
+    for form in forms:
+        form = fuzz(form, education_level, subjects, rng)
+        expected = reference_row(form, education_level, artifacts)
+        actual = schema.row(form)
+        if not np.array_equal(expected, actual):
+            mismatches.append([(schema.features[c], expected[0, c], actual[0, c])
+                               for c in np.nonzero(expected[0] != actual[0])[0]])
+    assert len(forms) == 400
+    assert not mismatches, mismatches[:3]
+
+
+@pytest.mark.parametrize('education_level', LEVELS)
+def test_shifted_ranks_match_rank(education_level):
+    schema = form_schema(get_artifacts(), education_level)
+    subjects = list(schema.rank_tables[0])
+    rng = random.Random(5)
+    shifts = np.array([-100, -50, -13.5, 0, 0.25, 7, 60, 100])
+
+    for _ in range(100):
+        k = rng.randint(1, 12)
+        names = [rng.choice(subjects) for _ in range(k)]
+        grades = [rng.choice(GRADES) for _ in range(k)]
+        scores = [rng.choice(['', str(rng.randint(0, 100)), str(rng.uniform(-5, 105))]) for _ in range(k)]
+        parsed = schema.subject_scores(names, grades, scores)
+
+        ranks = schema.shifted_ranks(names, grades, scores, shifts)
+        for shift, rank in zip(shifts.tolist(), ranks):
+            # Тот же студент с уже сдвинутыми баллами через rank.
+            shifted = [parsed[schema.rank_tables[0][name]] for name in names]
+            shifted = [repr(min(max(score + shift, min(score, 0.0)), max(score, 100.0))) for score in shifted]
+            assert rank == schema.rank(names, grades, shifted)
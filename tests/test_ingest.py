@@ -0,0 +1,76 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from artifacts import get_artifacts
+from benchmarks.cohort import cohort_csv, generate_cohort
+from ingest import iter_student_chunks, open_with_fallback
+from prediction import predict_csv_chunks, score_students
+
+KEY = 'id_студента'
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # Мелкие блоки и чанки: слияние проходит через много шагов и прогонов.
+    monkeypatch.setattr(ingest, 'SPILL_BLOCK_ROWS', 7)
+
+
+def shuffled_cohort(education_level='magistr', n_rows=3000, seed=0):
+    df = generate_cohort(education_level, n_rows, seed=seed)
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def read_chunks(df, chunk_rows=211, encoding='utf-8'):
+    stream = io.BytesIO(cohort_csv(df, encoding))
+    _, chunks = open_with_fallback(stream, lambda f, enc: iter_student_chunks(f, enc, chunk_rows))
+    return list(chunks)
+
+
+def test_chunks_hold_whole_students_in_file_order():
+    df = shuffled_cohort()
+    df.loc[df.sample(frac=0.02, random_state=1).index, KEY] = np.nan
+    df = pd.concat([df, df.iloc[:50]], ignore_index=True)
+    df['row'] = np.arange(len(df))
+
+    chunks = read_chunks(df)
+    seen = set()
+    for chunk in chunks:
+        ids = set(chunk[KEY])
+        assert not ids & seen
+        seen |= ids
+    merged = pd.concat(chunks, ignore_index=True)
+    assert merged[KEY].is_monotonic_increasing
+
+    expected = df[df[KEY].notna()].sort_values(KEY, kind='stable')
+    assert merged['row'].tolist() == expected['row'].tolist()
+
+
+def test_mixed_id_types_are_read_as_strings():
+    df = shuffled_cohort(n_rows=1500).astype({KEY: object})
+    df.loc[df.index[-100:], KEY] = 'x' + df.loc[df.index[-100:], KEY].astype(str)
+
+    merged = pd.concat(read_chunks(df), ignore_index=True)
+    assert merged[KEY].map(type).eq(str).all()
+    assert merged[KEY].tolist() == sorted(df[KEY].astype(str))
+
+
+def test_missing_key_column():
+    with pytest.raises(ValueError, match=KEY):
+        read_chunks(pd.DataFrame({'a': [1, 2], 'b': [3, 4]}))
+
+
+@pytest.mark.parametrize('education_level', ['magistr', 'bak_spec'])
+@pytest.mark.parametrize('encoding', ['utf-8', 'cp1251'])
+def test_unsorted_file_matches_whole_file(education_level, encoding):
+    df = shuffled_cohort(education_level, seed=2)
+    chunks = read_chunks(df, encoding=encoding)
+    streamed = pd.concat(list(predict_csv_chunks(chunks, education_level, get_artifacts())), ignore_index=True)
+
+    whole = pd.read_csv(io.BytesIO(cohort_csv(df, encoding)), sep=';', encoding=encoding)
+    whole['Уровень подготовки'] = 'Магистр' if education_level == 'magistr' else 'Бакалавр'
+    expected = score_students(whole, education_level)[1]
+    pd.testing.assert_frame_equal(streamed, expected)
@@ -0,0 +1,84 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+import metrics
+import parallel
+from artifacts import get_artifacts
+from benchmarks.cohort import generate_cohort
+from ingest import frame_student_chunks
+from metrics import INITIAL_FILE_SIZE, StageFile, StageMetrics
+from prediction import predict_csv_chunks
+
+
+def observe_in_child(collector, times):
+    for _ in range(times):
+        collector.observe('decode', 'magistr', 0.01, 10)
+
+
+def test_histograms_from_all_processes_are_summed(tmp_path):
+    collector = StageMetrics(str(tmp_path))
+    collector.observe('decode', 'magistr', 0.01, 10)
+    child = multiprocessing.get_context('fork').Process(target=observe_in_child, args=(collector, 3))
+    child.start()
+    child.join()
+
+    assert len(list(tmp_path.glob('stages_*.db'))) == 2
+    histogram = collector.snapshot()[('decode', 'magistr')]
+    assert histogram.count == 4
+    assert histogram.rows == 40
+    assert histogram.total == pytest.approx(0.04)
+    assert 'stage_rows_total{stage="decode",education_level="magistr"} 40' in collector.render()
+
+
+def test_file_grows_and_reopens(tmp_path):
+    path = str(tmp_path / 'stages_1.db')
+    stages = StageFile(path)
+    for i in range(1000):
+        stages.observe((f'stage{i}', 'bak_spec'), i % 5, 0.5, i)
+    stages.close()
+    assert (tmp_path / 'stages_1.db').stat().st_size > INITIAL_FILE_SIZE
+
+    # Тот же pid после перезапуска продолжает свой файл.
+    stages = StageFile(path)
+    stages.observe(('stage999', 'bak_spec'), 0, 0.5, 1)
+    stages.close()
+
+    snapshot = metrics.read_stage_files(str(tmp_path))
+    assert len(snapshot) == 1000
+    assert snapshot[('stage3', 'bak_spec')].counts[3] == 1
+    assert snapshot[('stage999', 'bak_spec')].count == 2
+    assert snapshot[('stage999', 'bak_spec')].rows == 1000
+
+
+def test_in_memory_without_directory():
+    collector = StageMetrics(None)
+    collector.observe('to_csv', 'magistr', 0.2, 5)
+    collector.observe('to_csv', 'magistr', 0.3, 5)
+
+    histogram = collector.snapshot()[('to_csv', 'magistr')]
+    assert (histogram.count, histogram.rows) == (2, 10)
+
+
+@pytest.fixture
+def shared_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.stage_metrics, 'directory', str(tmp_path))
+    monkeypatch.setattr(parallel.shard_pool, 'workers', 2)
+    yield metrics.stage_metrics
+    parallel.shard_pool.shutdown()
+    metrics.stage_metrics.reset()
+
+
+def test_shard_pool_timings_reach_parent(shared_metrics, tmp_path):
+    df = generate_cohort('bak_spec', 3000, seed=2)
+    chunks = frame_student_chunks(df, 500)
+    results = list(predict_csv_chunks(chunks, 'bak_spec', get_artifacts()))
+    students = len(pd.concat(results))
+
+    # Процессы пула пишут свои файлы, родитель видит их этапы.
+    assert len(list(tmp_path.glob('stages_*.db'))) >= 2
+    snapshot = shared_metrics.snapshot()
+    assert snapshot[('process_student_csv', 'bak_spec')].rows == len(df)
+    assert snapshot[('prepare_data', 'bak_spec')].rows == students
+    assert snapshot[('decode', 'bak_spec')].rows == len(df)
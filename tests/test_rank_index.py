@@ -0,0 +1,77 @@
+import bisect
+
+import numpy as np
+import pytest
+
+import rank_index
+from rank_index import RankIndex, merge_sorted, write_base, write_log
+
+
+def expected_ranks(reference, penalties):
+    return [bisect.bisect_right(reference, penalty) + 1 for penalty in penalties]
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    # Небольшой порог сжатия, чтобы за несколько вставок пройти и дельту, и сжатие.
+    monkeypatch.setattr(rank_index, 'RANK_INDEX_COMPACT_MIN', 50)
+    rng = np.random.default_rng(0)
+    base_path, log_path = rank_index.index_paths('magistr', str(tmp_path))
+    write_base(base_path, np.sort(rng.normal(0, 100, 500)), 0)
+    write_log(log_path, 0)
+    return str(tmp_path)
+
+
+def test_insert_matches_sorted_list(index_dir):
+    index = RankIndex.load('magistr', index_dir)
+    reference = sorted(index.base.tolist())
+    rng = np.random.default_rng(1)
+    generations = set()
+
+    for _ in range(30):
+        added = rng.normal(0, 100, rng.integers(1, 40))
+        index.insert(added)
+        reference = sorted(reference + added.tolist())
+        generations.add(index.generation)
+
+        queries = rng.normal(0, 120, 200)
+        assert index.ranks(queries).tolist() == expected_ranks(reference, queries)
+        reloaded = RankIndex.load('magistr', index_dir)
+        assert len(reloaded) == len(reference)
+        assert (reloaded.ranks(queries) == index.ranks(queries)).all()
+
+    assert len(generations) > 1
+
+
+def test_truncated_log_record_is_ignored(index_dir):
+    index = RankIndex.load('magistr', index_dir)
+    index.insert([1.0, 2.0, 3.0])
+    with open(index.log_path, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    assert len(RankIndex.load('magistr', index_dir)) == len(index)
+
+
+def test_crash_between_base_and_log_writes(index_dir):
+    index = RankIndex.load('magistr', index_dir)
+    index.insert([5.0, -5.0, 7.5])
+    reference = sorted(merge_sorted(index.base, index.delta).tolist())
+
+    # Сжатие записало базу нового поколения и упало до сброса журнала:
+    # журнал старого поколения уже влит в базу и не должен учитываться дважды.
+    write_base(index.base_path, merge_sorted(index.base, index.delta), index.generation + 1)
+    assert len(RankIndex.load('magistr', index_dir)) == len(reference)
+
+    # Объект, загруженный до сбоя, синхронизируется под блокировкой при вставке.
+    index.insert([1.0, 2.0])
+    reference = sorted(reference + [1.0, 2.0])
+    fresh = RankIndex.load('magistr', index_dir)
+    queries = np.linspace(-300, 300, 101)
+    assert len(fresh) == len(reference)
+    assert fresh.ranks(queries).tolist() == expected_ranks(reference, queries)
+
+
+def test_rejects_non_finite(index_dir):
+    index = RankIndex.load('magistr', index_dir)
+    with pytest.raises(ValueError):
+        index.insert([1.0, float('nan')])
+    assert len(RankIndex.load('magistr', index_dir)) == len(index.base)
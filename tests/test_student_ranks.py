@@ -0,0 +1,106 @@
+import bisect
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifacts import get_artifacts
+from benchmarks.cohort import generate_cohort
+from csv_func import IS_NA, calculate_student_ranks, power_penalty_scores, rank_arrays
+
+LEVELS = {'magistr': 'Магистр', 'bak_spec': 'Бакалавр'}
+
+
+# Прежняя скалярная реализация: словарь {студент: {дисциплина: балл}},
+# штраф по формуле на каждую дисциплину и bisect по списку эталонных штрафов.
+def old_penalty(student_scores, subject_stats, p=2.0):
+    total_score = 0
+    subject_count = 0
+    for subject, student_score in student_scores.items():
+        if subject not in subject_stats:
+            continue
+        mean_clean, fail_ratio = subject_stats[subject]
+        if student_score < 40:
+            adjusted = (mean_clean ** p) * (1 + math.log(1 / (fail_ratio + 1e-6)))
+        else:
+            delta = mean_clean - student_score
+            adjusted = math.copysign(abs(delta) ** p, delta) * fail_ratio
+        total_score += adjusted
+        subject_count += 1
+    return total_score / subject_count if subject_count else 0.0
+
+
+def old_ranks(df, subject_stats, sorted_penalties):
+    students = {}
+    for _, row in df.iterrows():
+        score = IS_NA.get(row['Оценка'], 0) if pd.isna(row['Баллы']) else row['Баллы']
+        students.setdefault(row['id_студента'], {})[row['Наименование дисциплины']] = score
+    return {student: bisect.bisect_right(sorted_penalties, old_penalty(scores, subject_stats)) + 1
+            for student, scores in students.items()}
+
+
+def reference(education_level):
+    stats, penalties = get_artifacts().rank_data(education_level)
+    subject_stats = {name: (mean, ratio) for name, mean, ratio
+                     in zip(stats.subjects, np.asarray(stats.mean_clean).tolist(), np.asarray(stats.fail_ratio).tolist())}
+    sorted_penalties = sorted(np.concatenate([penalties.base, penalties.delta]).tolist())
+    return subject_stats, sorted_penalties
+
+
+@pytest.mark.parametrize('education_level', list(LEVELS))
+def test_ranks_match_bisect_on_ties_and_bounds(education_level):
+    _, sorted_penalties = reference(education_level)
+    _, rank_index = rank_arrays(get_artifacts(), education_level)
+    values = np.array(sorted_penalties)
+    assert (np.diff(values) == 0).any()
+
+    # Сами эталонные значения (в том числе повторы), соседние числа, границы и выход за них.
+    queries = np.concatenate([
+        values,
+        np.nextafter(values, -np.inf),
+        np.nextafter(values, np.inf),
+        (values[1:] + values[:-1]) / 2,
+        [values[0] - 1, values[-1] + 1, -np.inf, np.inf, 0.0],
+    ])
+    expected = [bisect.bisect_right(sorted_penalties, q) + 1 for q in queries.tolist()]
+    assert rank_index.ranks(queries).tolist() == expected
+    assert [rank_index.rank(q) for q in queries[:50].tolist()] == expected[:50]
+
+
+@pytest.mark.parametrize('education_level', list(LEVELS))
+def test_power_penalty_scores_match_scalar_formula(education_level):
+    subject_stats, _ = reference(education_level)
+    arrays = rank_arrays(get_artifacts(), education_level)[0]
+    names = list(subject_stats)
+    rng = np.random.default_rng(4)
+
+    # Граница 40 и края шкалы, плюс баллы, равные среднему дисциплины (delta = 0).
+    n_students = 300
+    student_codes = np.repeat(np.arange(n_students), 6)
+    subject_codes = np.concatenate([rng.choice(len(names), 6, replace=False) for _ in range(n_students)])
+    special = np.array([0.0, 39.999, 40.0, 40.001, 100.0])
+    scores = np.where(rng.random(len(subject_codes)) < 0.3,
+                      special[rng.integers(0, len(special), len(subject_codes))],
+                      rng.uniform(0, 100, len(subject_codes)))
+    at_mean = rng.random(len(subject_codes)) < 0.05
+    scores[at_mean] = arrays[1][subject_codes[at_mean]]
+
+    actual = power_penalty_scores(student_codes, subject_codes, scores, arrays, n_students + 1)
+    expected = [old_penalty({names[s]: v for s, v in zip(subject_codes[student_codes == i].tolist(),
+                                                          scores[student_codes == i].tolist())}, subject_stats)
+                for i in range(n_students + 1)]
+    assert actual.tolist() == expected
+
+
+@pytest.mark.parametrize('education_level', list(LEVELS))
+def test_calculate_student_ranks_matches_old_implementation(education_level):
+    subject_stats, sorted_penalties = reference(education_level)
+    df = generate_cohort(education_level, 3000, seed=5)
+    # Повтор дисциплины у студента (учитывается последний балл) и оценки без баллов.
+    repeated = df.sample(200, random_state=5).assign(Баллы=np.nan, Оценка='незач.')
+    df = pd.concat([df, repeated], ignore_index=True)
+    df['Уровень подготовки'] = LEVELS[education_level]
+
+    expected = old_ranks(df, subject_stats, sorted_penalties)
+    assert calculate_student_ranks(df, get_artifacts()) == expected
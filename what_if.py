@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+from werkzeug.datastructures import MultiDict
+
+# Анализ «что если»: профиль студента (поля формы /predict и список дисциплин)
+# и сетка значений по осям. Все варианты собираются одной матрицей из строки
+# form_schema, ранги при сдвиге баллов считаются разом, модель вызывается один раз.
+WHAT_IF_MAX_VARIANTS = int(os.environ.get('WHAT_IF_MAX_VARIANTS', 10000))
+
+# Оси сетки: короткое имя -> признак модели. Можно указать и сам признак.
+AXES = {
+    'retakes': 'Общее количество пересдач',
+    'debts': 'Общее количество долгов',
+    'exam_score': 'Cумма баллов испытаний',
+    'achievement': 'Балл за инд. достижения',
+    'dormitory': 'Нуждается в общежитии',
+    'priority': 'Приоритет',
+    'contract': 'Контракт',
+    'age': 'Полных лет на момент поступления',
+}
+# Сдвиг баллов всех дисциплин: меняет позицию студента в рейтинге.
+SCORE_SHIFT = 'score_shift'
+RANK_FEATURE = 'Позиция студента в рейтинге'
+
+
+def profile_form(profile, education_level: str) -> MultiDict:
+    # {"exam_score": 210, ..., "subjects": [{"name", "grade", "score", "retakes"}]}
+    # в том виде, в каком поля приходят из формы /predict.
+    if not isinstance(profile, dict):
+        raise ValueError("Профиль студента должен быть JSON-объектом")
+    prefix = 'b_' if education_level == 'bak_spec' else 'm_'
+    form = MultiDict({key: str(value) for key, value in profile.items() if key != 'subjects'})
+    subjects = profile.get('subjects') or []
+    if not isinstance(subjects, list) or not all(isinstance(subject, dict) for subject in subjects):
+        raise ValueError("subjects должен быть списком объектов")
+    for subject in subjects:
+        score = subject.get('score')
+        form.add(f'{prefix}subject_name[]', str(subject.get('name', '')))
+        form.add(f'{prefix}subject_grade[]', str(subject.get('grade', '')))
+        form.add(f'{prefix}subject_score[]', '' if score is None else str(score))
+        form.add(f'{prefix}subject_retakes[]', str(subject.get('retakes', 0)))
+    return form
+
+
+def parse_grid(grid, features) -> list:
+    # [(ось, признак или None для score_shift, значения)] в порядке запроса.
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError("Сетка должна быть непустым объектом {ось: [значения]}")
+    features = set(features)
+    axes = []
+    variants = 1
+    for axis, values in grid.items():
+        feature = None if axis == SCORE_SHIFT else AXES.get(axis, axis)
+        if feature is not None and (feature not in features or feature == RANK_FEATURE):
+            raise ValueError(f"Неизвестная ось {axis}, доступны: {', '.join([SCORE_SHIFT, *AXES])} "
+                             f"или признак модели")
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Ось {axis}: ожидается непустой список значений")
+        try:
+            values = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f"Ось {axis}: значения должны быть числами")
+        if values.ndim != 1 or not np.isfinite(values).all():
+            raise ValueError(f"Ось {axis}: значения должны быть конечными числами")
+        variants *= len(values)
+        if variants > WHAT_IF_MAX_VARIANTS:
+            raise ValueError(f"Слишком много вариантов, допускается не больше {WHAT_IF_MAX_VARIANTS}")
+        axes.append((axis, feature, values))
+    return axes
+
+
+def what_if_matrix(schema, form, axes) -> np.ndarray:
+    # Строка 0 — профиль без изменений, далее варианты сетки в C-порядке
+    # (последняя ось меняется быстрее всего).
+    base = schema.row(form)
+    shape = [len(values) for _, _, values in axes]
+    grids = np.meshgrid(*[values for _, _, values in axes], indexing='ij')
+
+    X = np.repeat(base, 1 + int(np.prod(shape)), axis=0)
+    for (axis, feature, _), grid in zip(axes, grids):
+        if feature is not None:
+            X[1:, schema.column(feature)] = grid.ravel()
+        elif schema.rank_column >= 0:
+            prefix = 'b_' if schema.education_level == 'bak_spec' else 'm_'
+            shifts, inverse = np.unique(grid.ravel(), return_inverse=True)
+            ranks = schema.shifted_ranks(form.getlist(f'{prefix}subject_name[]'),
+                                         form.getlist(f'{prefix}subject_grade[]'),
+                                         form.getlist(f'{prefix}subject_score[]'), shifts)
+            X[1:, schema.rank_column] = ranks[inverse]
+    return X
+
+
+def what_if_surface(axes, proba: np.ndarray, threshold) -> dict:
+    shape = [len(values) for _, _, values in axes]
+    probability = (np.asarray(proba, dtype=np.float64) * 100).round(2)
+    return {
+        'base': {'probability': float(probability[0]),
+                 'recommendation': "more" if proba[0] >= threshold else "less"},
+        'axes': [{'name': axis, 'feature': feature or RANK_FEATURE, 'values': values.tolist()}
+                 for axis, feature, values in axes],
+        'shape': shape,
+        'probability': probability[1:].reshape(shape).tolist(),
+        'threshold': round(float(threshold) * 100, 2),
+        'count': int(np.prod(shape)),
+    }